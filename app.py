@@ -1,67 +1,3110 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, redirect, g, has_request_context
 from flask_cors import CORS
 import os
 import subprocess
 import json
 import re
+import time
+import shutil
 import uuid
+import hashlib
+import sqlite3
+import threading
+import random
+import contextlib
+import functools
+import math
+import multiprocessing
+import importlib
+import mimetypes
+import socket
 import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
 from googletrans import Translator  # مكتبة الترجمة المجانية
-import whisper  # مكتبة Whisper
+try:
+    import orjson  # اختياري: تحليل أسرع لمخرجات yt-dlp الكبيرة (--dump-json)
+except ImportError:
+    orjson = None
+try:
+    import redis  # اختياري: مخزن تنسيق مشترك بين عدة نسخ (COORDINATION_BACKEND=redis)
+except ImportError:
+    redis = None
+from transcription import SAMPLE_RATE, ChunkedTranscriber, StreamCancelled, decode_audio_pcm, stream_audio_pcm
 
 app = Flask(__name__)
 CORS(app)
 
 # مجلد التنزيلات (ضمن /tmp لأن معظم البيئات المستضافة تسمح بالكتابة فيه فقط)
-DOWNLOAD_FOLDER = "/tmp/video_downloads"
+DOWNLOAD_FOLDER = os.environ.get("DOWNLOAD_FOLDER", "/tmp/video_downloads")
 if not os.path.exists(DOWNLOAD_FOLDER):
     os.makedirs(DOWNLOAD_FOLDER)
 app.config["DOWNLOAD_FOLDER"] = DOWNLOAD_FOLDER
 
+# مجلد الكاش الداخلي (لا يُخدَم عبر /api/serve لأن اسمه يبدأ بنقطة)
+CACHE_FOLDER = os.path.join(DOWNLOAD_FOLDER, ".cache")
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+# إعدادات كاش بيانات الفيديو (يمكن تعديلها عبر متغيرات البيئة)
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", 256))
+METADATA_CACHE_TTL = int(os.environ.get("METADATA_CACHE_TTL", 3600))
+METADATA_CACHE_DISK = os.environ.get("METADATA_CACHE_DISK", "1") == "1"
+# أقصى حجم لطبقة القرص؛ منظّف القرص يحذف المنتهية صلاحيتها ثم الأقرب انتهاءً عند التجاوز
+METADATA_CACHE_DISK_MAX_BYTES = int(os.environ.get("METADATA_CACHE_DISK_MAX_BYTES", 100 * 1024 * 1024))
+# هامش أمان قبل انتهاء صلاحية روابط download_url الموقّعة
+METADATA_URL_EXPIRY_MARGIN = int(os.environ.get("METADATA_URL_EXPIRY_MARGIN", 300))
+
+# برنامج yt-dlp الذي يُشغَّل (يمكن توجيهه لنسخة بديلة، مثل benchmarks/stubs/yt-dlp للقياس دون إنترنت)
+YT_DLP_PATH = os.environ.get("YT_DLP_PATH", "yt-dlp")
+
+# طريقة تشغيل yt-dlp: "subprocess" (سطر الأوامر لكل طلب) أو "inprocess" (مكتبة yt_dlp داخل العملية)
+YTDLP_ENGINE = os.environ.get("YTDLP_ENGINE", "subprocess")
+YTDLP_ENGINE_WORKERS = int(os.environ.get("YTDLP_ENGINE_WORKERS", 4))
+
+# طريقة خدمة الملفات في /api/serve:
+#   "direct"     Flask يرسل الملف (مع sendfile عبر wsgi.file_wrapper إن وفّره الخادم مثل gunicorn)
+#   "x-sendfile" ترويسة X-Sendfile لخادم أمامي (Apache/lighttpd) يرسل الملف بنفسه
+#   "x-accel"    ترويسة X-Accel-Redirect لـ nginx؛ SERVE_ACCEL_PREFIX هو المسار الداخلي المقابل لـ DOWNLOAD_FOLDER
+SERVE_MODE = os.environ.get("SERVE_MODE", "direct")
+SERVE_ACCEL_PREFIX = os.environ.get("SERVE_ACCEL_PREFIX", "/protected-downloads/")
+SERVE_MAX_AGE = int(os.environ.get("SERVE_MAX_AGE", 86400))
+app.config["USE_X_SENDFILE"] = SERVE_MODE == "x-sendfile"
+
+# ترجمة الترجمات: حجم الدفعة بالأحرف، عدد الطلبات المتوازية، وعدد مرات إعادة المحاولة
+TRANSLATE_BATCH_CHARS = int(os.environ.get("TRANSLATE_BATCH_CHARS", 4000))
+TRANSLATE_WORKERS = int(os.environ.get("TRANSLATE_WORKERS", 4))
+TRANSLATE_RETRIES = int(os.environ.get("TRANSLATE_RETRIES", 3))
+TRANSLATE_BACKOFF = float(os.environ.get("TRANSLATE_BACKOFF", 0.5))
+
+# ذاكرة الترجمة: قاعدة SQLite محلية للأسطر المترجمة سابقًا، بحد أقصى لعدد الأسطر
+TRANSLATION_MEMORY_PATH = os.environ.get(
+    "TRANSLATION_MEMORY_PATH", os.path.join(CACHE_FOLDER, "translation_memory.sqlite3")
+)
+TRANSLATION_MEMORY_MAX_ENTRIES = int(os.environ.get("TRANSLATION_MEMORY_MAX_ENTRIES", 200000))
+# آخر ترجمة لكل مسار ترجمة على مستوى الكتل (لإعادة الترجمة التزايدية): أقصى عدد مسارات محفوظة،
+# وأقصى فرق (ms) في توقيت كتلة بنفس النص بين النسختين حتى تُعتبر نفس الكتلة
+SUBTITLE_VERSIONS_MAX_TRACKS = int(os.environ.get("SUBTITLE_VERSIONS_MAX_TRACKS", 5000))
+SUBTITLE_ALIGN_TOLERANCE_MS = int(os.environ.get("SUBTITLE_ALIGN_TOLERANCE_MS", 2000))
+
+# عدد التنزيلات التي تعمل في الخلفية في نفس الوقت، ومدة الاحتفاظ بحالة المهام المنتهية
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", 2))
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 3600))
+# أقصى عدد مهام تنتظر في طابور الخلفية؛ بعده تُرفض المهام الجديدة بـ 503 و Retry-After (بالثواني)
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", 32))
+JOB_QUEUE_RETRY_AFTER = int(os.environ.get("JOB_QUEUE_RETRY_AFTER", 30))
+
+# التحكم في القبول: لكل فئة عمل "الاسم=المتزامن:حجم_الطابور:أقصى_انتظار_بالثواني"
+#   light     video-info، الصور المصغّرة، طلبات التنزيل وطلبات الترجمة غير المتزامنة
+#   subtitle  تنزيل الترجمات وترجمتها
+#   heavy     generate-translation المتزامن (تنزيل صوت + Whisper)
+#   stream    /api/stream-video (يبقى محجوزًا حتى نهاية البث)
+#   batch     /api/batch/video-info
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+# القيم في متغير البيئة تُدمج فوق القيم الافتراضية، فيكفي ذكر الفئات المراد تغييرها
+ADMISSION_DEFAULT_CLASSES = {
+    "light": (16, 64, 5),
+    "subtitle": (4, 16, 15),
+    "heavy": (2, 4, 30),
+    "stream": (8, 8, 5),
+    "batch": (2, 4, 10),
+}
+ADMISSION_CLASSES = os.environ.get("ADMISSION_CLASSES", "")
+# أقصى عدد طلبات منتظرة لنفس العميل في كل فئة (ما زاد يُرفض بـ 429)
+ADMISSION_CLIENT_QUEUE = int(os.environ.get("ADMISSION_CLIENT_QUEUE", 4))
+# ترويسة تعرّف العميل خلف وكيل عكسي (مثل X-Forwarded-For)؛ فارغة = عنوان الاتصال المباشر
+ADMISSION_CLIENT_HEADER = os.environ.get("ADMISSION_CLIENT_HEADER", "")
+
+# مخزن الملفات الناتجة حسب المحتوى (فيديو، صيغة، إعدادات الدمج): الطلبات المتطابقة تتشارك ملفًا واحدًا
+ARTIFACT_STORE_FOLDER = os.path.join(CACHE_FOLDER, "store")
+# منظّف القرص: الحد الأقصى لحجم التنزيلات، ونسبة الحجم التي ينزل إليها عند التجاوز،
+# وأقصى عمر منذ آخر استخدام، والفاصل بين الجولات (بالثواني)
+GC_ENABLED = os.environ.get("GC_ENABLED", "1") == "1"
+GC_MAX_BYTES = int(os.environ.get("GC_MAX_BYTES", 5 * 1024 ** 3))
+GC_LOW_WATER = float(os.environ.get("GC_LOW_WATER", 0.8))
+GC_MAX_AGE = int(os.environ.get("GC_MAX_AGE", 24 * 3600))
+GC_INTERVAL = int(os.environ.get("GC_INTERVAL", 60))
+
+# جلسة HTTP مشتركة لجلب الترجمات والصور المصغّرة مباشرة من روابط البيانات المخزّنة:
+# عدد الاتصالات المحفوظة لكل مضيف، ومهلة الطلب بالثواني
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 10))
+
+# الطلبات المجمّعة (/api/batch/video-info): عدد الاستخراجات المتوازية الكلي، والحد لكل منصة،
+# وأقصى عدد عناصر في الطلب الواحد
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 8))
+BATCH_PER_HOST = int(os.environ.get("BATCH_PER_HOST", 4))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+
+# وضع البث المباشر (/api/stream-video): حجم القطعة المرسلة، وهل تُحفظ نسخة في المخزن أثناء البث
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 64 * 1024))
+STREAM_TEE = os.environ.get("STREAM_TEE", "1") == "1"
+
+# إعدادات الدمج الافتراضية، تُستخدم عندما لا تتوفر بيانات الصيغ لتخطيط التنزيل
+DOWNLOAD_MERGE_SETTINGS = {"audio": "bestaudio", "merge_output_format": "mp4"}
+# الحاويات التي يُدمج فيها الفيديو مع الصوت بالنسخ المباشر (دون إعادة ترميز) بترتيب الأفضلية:
+# (الحاوية، عائلات ترميز الفيديو المقبولة، عائلات ترميز الصوت المقبولة). mkv تقبل أي ترميز.
+MERGE_CONTAINERS = (
+    ("mp4", ("avc1", "avc3", "h264", "hev1", "hvc1", "av01", "vp09"), ("mp4a", "aac", "mp3", "ac-3", "ec-3")),
+    ("webm", ("vp8", "vp9", "vp09", "av01"), ("opus", "vorbis")),
+)
+
+# التنسيق بين عدة نسخ خلف موزّع حمل (حالة المهام، الكاشات، أماكن الملفات، وتوجيه /api/serve):
+#   COORDINATION_BACKEND  "local" (SQLite؛ يكفي لنسخ تتشارك نفس القرص) أو "redis" (أي خادم متوافق مع Redis)
+#   NODE_ID / NODE_URL    اسم هذه النسخة ورابطها الداخلي الذي تصل إليه النسخ الأخرى؛ بدون NODE_URL يبقى التنسيق معطلًا
+#   COORDINATION_TTL      مدة بقاء الكاشات المشتركة، و NODE_HEARTBEAT الفاصل بين إعلانات النسخة عن نفسها (بالثواني)
+#   COORDINATION_TRANSCRIPT_TTL  مدة بقاء التفريغات المشتركة (أكبر المدخلات حجمًا)
+#   COORDINATION_MAX_BYTES حد حجم الكاشات المشتركة في المخزن المحلي (Redis يُحدّ عبر maxmemory في الخادم)
+COORDINATION_BACKEND = os.environ.get("COORDINATION_BACKEND", "local")
+COORDINATION_PATH = os.environ.get("COORDINATION_PATH", os.path.join(CACHE_FOLDER, "coordination.sqlite3"))
+COORDINATION_REDIS_URL = os.environ.get("COORDINATION_REDIS_URL", "redis://localhost:6379/0")
+COORDINATION_PREFIX = os.environ.get("COORDINATION_PREFIX", "video-downloader:")
+COORDINATION_TTL = int(os.environ.get("COORDINATION_TTL", 7 * 24 * 3600))
+COORDINATION_TRANSCRIPT_TTL = int(os.environ.get("COORDINATION_TRANSCRIPT_TTL", 24 * 3600))
+COORDINATION_MAX_BYTES = int(os.environ.get("COORDINATION_MAX_BYTES", 256 * 1024 * 1024))
+NODE_ID = os.environ.get("NODE_ID", socket.gethostname())
+NODE_URL = os.environ.get("NODE_URL", "")
+NODE_HEARTBEAT = int(os.environ.get("NODE_HEARTBEAT", 15))
+
+# ترويسة الطلب التي تضيف أزمنة مراحل المعالجة إلى الاستجابة (Server-Timing) للتشخيص
+METRICS_DEBUG_HEADER = os.environ.get("METRICS_DEBUG_HEADER", "X-Debug-Timings")
+
 # مُترجم Google Translate 
 translator = Translator()
 
-# سنحمّل نموذج Whisper بشكل lazy (أوّل حاجة فقط عند الطلب)
-whisper_model = None
+# نماذج Whisper: تُدار عبر WhisperModelManager (انظر قسم "نماذج Whisper")
+WHISPER_DEFAULT_MODEL = os.environ.get("WHISPER_DEFAULT_MODEL", "tiny")
+WHISPER_MODELS = tuple(m for m in os.environ.get("WHISPER_MODELS", "tiny,base,small").split(",") if m)
+# النماذج التي تُحمَّل في الخلفية عند بدء التشغيل (فارغ لتعطيل التحميل المسبق)
+WHISPER_PRELOAD = tuple(m for m in os.environ.get("WHISPER_PRELOAD", WHISPER_DEFAULT_MODEL).split(",") if m)
+# أقصى ذاكرة تقريبية (MB) للنماذج المحمّلة معًا؛ الأقدم استخدامًا يُفرَّغ عند التجاوز
+WHISPER_MEMORY_BUDGET_MB = int(os.environ.get("WHISPER_MEMORY_BUDGET_MB", 1500))
+# عدد عمليات التفريغ المتزامنة (0 = تلقائي حسب عدد الأنوية)
+WHISPER_CONCURRENCY = int(os.environ.get("WHISPER_CONCURRENCY", 0))
+# دالة تحميل بديلة بصيغة "module:function" تستقبل حجم النموذج وتعيده (فارغ = whisper.load_model)
+WHISPER_MODEL_LOADER = os.environ.get("WHISPER_MODEL_LOADER", "")
+# كاش التفريغ النصي (مقاطع Whisper) على القرص، بحد أقصى للحجم
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.environ.get("TRANSCRIPT_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+# التفريغ على قطع للصوت الطويل: أقصى عدد عمليات (0 = عدد الأنوية)، طول القطع، وأقل مدة صوت
+# (بالثواني) تستحق التقسيم. TRANSCRIBE_CHUNKED=0 يعطّله.
+# كل عملية تحمّل نسختها من النموذج، لذلك يُقيَّد العدد لكل طلب بحيث لا تتجاوز العمليات × ذاكرة
+# النموذج المطلوب WHISPER_MEMORY_BUDGET_MB؛ إذا بقيت عملية واحدة تُفرَّغ القطع تباعًا داخل العملية.
+TRANSCRIBE_CHUNKED = os.environ.get("TRANSCRIBE_CHUNKED", "1") == "1"
+TRANSCRIBE_PROCESSES = int(os.environ.get("TRANSCRIBE_PROCESSES", 0))
+TRANSCRIBE_CHUNK_SECONDS = int(os.environ.get("TRANSCRIBE_CHUNK_SECONDS", 30))
+TRANSCRIBE_MAX_CHUNK_SECONDS = int(os.environ.get("TRANSCRIBE_MAX_CHUNK_SECONDS", 60))
+TRANSCRIBE_CHUNKED_MIN_SECONDS = int(os.environ.get("TRANSCRIBE_CHUNKED_MIN_SECONDS", 120))
+# المسار السريع للصوت: أصغر صيغة صوتية كافية تُمرَّر مباشرة إلى ffmpeg ثم إلى Whisper دون ملفات
+TRANSCRIBE_AUDIO_FAST_PATH = os.environ.get("TRANSCRIBE_AUDIO_FAST_PATH", "1") == "1"
+# أقل معدل بت (kbps) مقبول للتفريغ؛ Whisper يعمل على 16 kHz أحادي فلا حاجة لأكثر من ذلك
+TRANSCRIBE_AUDIO_MIN_ABR = float(os.environ.get("TRANSCRIBE_AUDIO_MIN_ABR", 32))
 
 
 # --- دوال مساعدة --- #
 
 def get_yt_dlp_path():
-    return "yt-dlp"
+    return YT_DLP_PATH
+
+def json_loads(data):
+    """يحلّل JSON (نص أو bytes) عبر orjson إن كانت مثبّتة، وإلا عبر json."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps_bytes(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
 
 def is_valid_url(url):
     pattern = r"^(https?://)?(www\.)?(youtu\.be|youtube\.com|twitter\.com|x\.com)/.+"
     return re.match(pattern, url)
 
-def sanitize_filename(name):
-    """
-    تنظيف اسم الملف من الأحرف غير الصالحة واستبدال الفراغات بشرطة سفلية
-    """
-    name = re.sub(r'[\\/*?"<>|]', "", name)
-    name = re.sub(r'\s+', '_', name)
-    return name[:100]
+def sanitize_filename(name):
+    """
+    تنظيف اسم الملف من الأحرف غير الصالحة واستبدال الفراغات بشرطة سفلية
+    """
+    name = re.sub(r'[\\/*?"<>|]', "", name)
+    name = re.sub(r'\s+', '_', name)
+    return name[:100]
+
+YOUTUBE_ID_RE = re.compile(
+    r"(?:youtu\.be/|youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/))([A-Za-z0-9_-]{11})"
+)
+TWITTER_ID_RE = re.compile(r"(?:twitter\.com|x\.com)/(?:[^/]+/status(?:es)?|i/web/status)/(\d+)")
+
+def video_cache_key(url):
+    """
+    مفتاح موحّد للفيديو: نفس الفيديو بروابط مختلفة (youtu.be، watch?v=، shorts...)
+    يعطي نفس المفتاح.
+    """
+    m = YOUTUBE_ID_RE.search(url)
+    if m:
+        return f"youtube:{m.group(1)}"
+    m = TWITTER_ID_RE.search(url)
+    if m:
+        return f"twitter:{m.group(1)}"
+    return "url:" + hashlib.sha1(url.strip().encode("utf-8")).hexdigest()
+
+def url_expiry(url):
+    """
+    يعيد وقت انتهاء صلاحية الرابط الموقّع (expire=... أو /expire/.../) إن وُجد.
+    """
+    if not url:
+        return None
+    parsed = urllib.parse.urlparse(url)
+    expire = urllib.parse.parse_qs(parsed.query).get("expire")
+    if expire and expire[0].isdigit():
+        return int(expire[0])
+    m = re.search(r"/expire/(\d+)", parsed.path)
+    return int(m.group(1)) if m else None
+
+
+
+# --- المقاييس (Metrics) --- #
+
+class Metrics:
+    """
+    سجل مقاييس بسيط داخل العملية يُعرض بصيغة Prometheus النصية عبر /metrics:
+    عدّادات (counter) ومدرّجات زمنية (histogram) بتسميات، ومقاييس لحظية (gauge) تُحسب عند القراءة
+    من دوال مسجّلة عبر add_collector.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    entry[0][i] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def add_collector(self, fn):
+        """
+        fn() تعيد قائمة (name, labels_dict, value) لمقاييس تُقرأ لحظة العرض: gauge، أو counter
+        لعدّادات قائمة في مكوّن آخر (نوعها حسب describe).
+        """
+        self._collectors.append(fn)
+
+    def _format(self, name, labels, value, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        rendered = ",".join(
+            '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels
+        )
+        return f"{self.prefix}{name}{{{rendered}}} {value}" if rendered else f"{self.prefix}{name} {value}"
+
+    def render(self):
+        series = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                series.setdefault(name, []).append(self._format(name, labels, value))
+            for (name, labels), (buckets, total, count) in self._histograms.items():
+                lines = series.setdefault(name, [])
+                for bound, bucket in zip(self.BUCKETS, buckets):
+                    lines.append(self._format(f"{name}_bucket", labels, bucket, (("le", bound),)))
+                lines.append(self._format(f"{name}_bucket", labels, count, (("le", "+Inf"),)))
+                lines.append(self._format(f"{name}_sum", labels, round(total, 6)))
+                lines.append(self._format(f"{name}_count", labels, count))
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    series.setdefault(name, []).append(self._format(name, self._labels(labels), value))
+            except Exception as e:
+                app.logger.warning(f"Metrics collector failed: {e}")
+
+        out = []
+        for name in sorted(series):
+            kind, help_text = self._help.get(name, ("untyped", name))
+            out.append(f"# HELP {self.prefix}{name} {help_text}")
+            out.append(f"# TYPE {self.prefix}{name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics("video_downloader_")
+metrics.describe("http_request_duration_seconds", "histogram", "HTTP request latency by endpoint.")
+metrics.describe("stage_duration_seconds", "histogram", "Duration of pipeline stages.")
+metrics.describe("subprocess_duration_seconds", "histogram", "Duration of external tool runs (yt-dlp, ffmpeg).")
+metrics.describe("subprocess_total", "counter", "External tool runs by outcome.")
+metrics.describe("served_bytes_total", "counter", "Bytes sent to clients from /api/serve and /api/stream-video.")
+
+
+def record_stage(pipeline, stage, seconds):
+    """يسجّل زمن مرحلة، ويضيفه لأزمنة الطلب الحالي إن وُجد (لترويسة Server-Timing)."""
+    metrics.observe("stage_duration_seconds", seconds, pipeline=pipeline, stage=stage)
+    if has_request_context():
+        g.setdefault("stage_timings", []).append((stage, seconds))
+
+
+@contextlib.contextmanager
+def timed_stage(pipeline, stage):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        record_stage(pipeline, stage, time.monotonic() - started)
+
+
+@contextlib.contextmanager
+def track_subprocess(program, operation):
+    """يقيس زمن تشغيل أداة خارجية ويعدّ نتيجته (ok/timeout/error/cancelled)."""
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except subprocess.TimeoutExpired:
+        outcome = "timeout"
+        raise
+    except JobCancelled:
+        outcome = "cancelled"
+        raise
+    finally:
+        record_subprocess(program, operation, time.monotonic() - started, outcome)
+
+
+def record_subprocess(program, operation, seconds, outcome):
+    """يسجّل تشغيلًا انتهى لأداة خارجية (لما لا يمكن لفّه في track_subprocess، مثل البث)."""
+    metrics.observe("subprocess_duration_seconds", seconds, program=program, operation=operation)
+    metrics.inc("subprocess_total", program=program, operation=operation, outcome=outcome)
+
+
+# --- التحكم في القبول --- #
+
+class AdmissionRejected(Exception):
+    """
+    رفض طلب لأن الخادم مشغول: 429 عندما يتجاوز العميل حصته، و 503 عندما يكون الخادم مشبعًا.
+    retry_after هو عدد الثواني المقترح قبل إعادة المحاولة (ترويسة Retry-After).
+    """
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("client", "event", "admitted")
+
+    def __init__(self, client):
+        self.client = client
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class _Workload:
+    """حالة فئة عمل واحدة: الطلبات الجارية، وطوابير الانتظار لكل عميل، وإحصاءاتها."""
+
+    def __init__(self, name, concurrency, queue_size, max_wait):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.queue_size = int(queue_size)
+        self.max_wait = max_wait
+        self.running = 0
+        self.running_by_client = {}
+        self.queues = OrderedDict()  # العميل -> deque من _Waiter
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {429: 0, 503: 0}
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.service_avg = None  # متوسط متحرك لزمن خدمة الطلب (لتقدير Retry-After)
+
+
+class AdmissionController:
+    """
+    يقسم الطلبات إلى فئات عمل لكل منها عدد طلبات متزامنة وطابور انتظار محدودان، فلا تحجز
+    طلبات Whisper الطويلة كل خيوط الخادم عن استعلامات video-info الخفيفة.
+    عند تحرر مكان في الفئة يُقدَّم العميل الأقل طلبات جارية فيها (حصة عادلة بين العملاء)،
+    ولكل عميل حد لطلباته المنتظرة. عند التشبع يُرفض الطلب فورًا بـ 429/503 مع Retry-After
+    بدل أن ينتظر حتى مهلة الخادم.
+    """
+
+    def __init__(self, classes, client_queue, enabled=True):
+        self.enabled = enabled
+        self.client_queue = client_queue
+        self._workloads = {name: _Workload(name, *limits) for name, limits in classes.items()}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_classes(spec, defaults):
+        """
+        يدمج "الاسم=المتزامن:حجم_الطابور:أقصى_انتظار,..." فوق defaults. يرمي ValueError عند بدء
+        التشغيل لأي مدخل غير صالح أو فئة غير معروفة، بدل أن يظهر الخطأ عند أول طلب.
+        """
+        classes = dict(defaults)
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, limits = item.partition("=")
+            name = name.strip()
+            if name not in defaults:
+                raise ValueError(f"ADMISSION_CLASSES: unknown workload class {name!r} "
+                                 f"(expected one of {', '.join(defaults)})")
+            try:
+                concurrency, queue_size, max_wait = (float(v) for v in limits.split(":"))
+            except ValueError:
+                raise ValueError(f"ADMISSION_CLASSES: invalid entry {item!r}, "
+                                 f"expected name=concurrency:queue_size:max_wait") from None
+            if concurrency < 1 or queue_size < 0 or max_wait < 0:
+                raise ValueError(f"ADMISSION_CLASSES: entry {item!r} needs concurrency >= 1 "
+                                 f"and non-negative queue_size and max_wait")
+            classes[name] = (concurrency, queue_size, max_wait)
+        return classes
+
+    def _retry_after(self, state):
+        # الطلبات المنتظرة أمام العميل ÷ عدد المتزامن × متوسط زمن الخدمة
+        service = state.service_avg if state.service_avg is not None else 1.0
+        return max(1, min(120, math.ceil(service * (state.queued + 1) / state.concurrency)))
+
+    def _reject_locked(self, state, status_code, message):
+        state.rejected[status_code] += 1
+        metrics.inc("admission_rejected_total", workload=state.name, status=status_code)
+        return AdmissionRejected(message, status_code, self._retry_after(state))
+
+    def _start_locked(self, state, client):
+        state.running += 1
+        state.running_by_client[client] = state.running_by_client.get(client, 0) + 1
+
+    def _dispatch_locked(self, state):
+        # نختار العميل الأقل طلبات جارية؛ عند التساوي الأقدم انتظارًا (ترتيب OrderedDict)
+        while state.running < state.concurrency and state.queued:
+            client = min(state.queues, key=lambda c: state.running_by_client.get(c, 0))
+            queue = state.queues.pop(client)
+            waiter = queue.popleft()
+            if queue:
+                # يعود العميل لآخر الدور حتى لا يستأثر بالأماكن المتحررة
+                state.queues[client] = queue
+            state.queued -= 1
+            waiter.admitted = True
+            self._start_locked(state, client)
+            waiter.event.set()
+
+    def acquire(self, workload, client):
+        """يحجز مكانًا في الفئة (منتظرًا حتى max_wait عند الحاجة) أو يرمي AdmissionRejected."""
+        state = self._workloads[workload]
+        started = time.monotonic()
+        with self._lock:
+            if state.running < state.concurrency and not state.queued:
+                self._start_locked(state, client)
+                waiter = None
+            elif state.queued >= state.queue_size:
+                raise self._reject_locked(state, 503, "Server is busy. Please retry later.")
+            elif len(state.queues.get(client, ())) >= self.client_queue:
+                raise self._reject_locked(state, 429, "Too many pending requests from this client.")
+            else:
+                waiter = _Waiter(client)
+                state.queues.setdefault(client, deque()).append(waiter)
+                state.queued += 1
+
+        if waiter is not None:
+            waiter.event.wait(state.max_wait)
+            with self._lock:
+                if not waiter.admitted:
+                    queue = state.queues[client]
+                    queue.remove(waiter)
+                    if not queue:
+                        del state.queues[client]
+                    state.queued -= 1
+                    state.timeouts += 1
+                    raise self._reject_locked(state, 503, "Server is busy. Request waited too long in the queue.")
+
+        waited = time.monotonic() - started
+        with self._lock:
+            state.admitted += 1
+            state.wait_total += waited
+            state.wait_max = max(state.wait_max, waited)
+        metrics.observe("admission_wait_seconds", waited, workload=workload)
+        return waited
+
+    def release(self, workload, client, service_seconds):
+        state = self._workloads[workload]
+        with self._lock:
+            state.running -= 1
+            remaining = state.running_by_client.get(client, 1) - 1
+            if remaining:
+                state.running_by_client[client] = remaining
+            else:
+                state.running_by_client.pop(client, None)
+            if state.service_avg is None:
+                state.service_avg = service_seconds
+            else:
+                state.service_avg = 0.8 * state.service_avg + 0.2 * service_seconds
+            self._dispatch_locked(state)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "concurrency": state.concurrency,
+                    "queue_size": state.queue_size,
+                    "running": state.running,
+                    "queued": state.queued,
+                    "clients": len(set(state.running_by_client) | set(state.queues)),
+                    "admitted": state.admitted,
+                    "rejected_429": state.rejected[429],
+                    "rejected_503": state.rejected[503],
+                    "timeouts": state.timeouts,
+                    "avg_wait_seconds": round(state.wait_total / state.admitted, 4) if state.admitted else 0.0,
+                    "max_wait_seconds": round(state.wait_max, 4),
+                    "avg_service_seconds": round(state.service_avg or 0.0, 4),
+                }
+                for name, state in self._workloads.items()
+            }
+
+
+admission_controller = AdmissionController(
+    AdmissionController.parse_classes(ADMISSION_CLASSES, ADMISSION_DEFAULT_CLASSES),
+    ADMISSION_CLIENT_QUEUE,
+    ADMISSION_ENABLED,
+)
+metrics.describe("admission_wait_seconds", "histogram", "Time requests waited for admission per workload class.")
+metrics.describe("admission_rejected_total", "counter", "Requests rejected by admission control (429/503).")
+
+
+def client_id():
+    """معرّف العميل للحصة العادلة: أول عنوان في ADMISSION_CLIENT_HEADER إن ضُبطت، وإلا عنوان الاتصال."""
+    if ADMISSION_CLIENT_HEADER:
+        forwarded = request.headers.get(ADMISSION_CLIENT_HEADER, "").split(",")[0].strip()
+        if forwarded:
+            return forwarded
+    return request.remote_addr or "unknown"
+
+
+def admission(workload):
+    """
+    مزخرف لنقاط النهاية: يحجز مكانًا في فئة العمل قبل التنفيذ ويحرره بعده. workload اسم فئة
+    أو دالة تعيده حسب الطلب. الاستجابات المتدفقة (بث، NDJSON) تبقى محجوزة حتى إغلاقها.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not admission_controller.enabled:
+                return fn(*args, **kwargs)
+            name = workload() if callable(workload) else workload
+            client = client_id()
+            admission_controller.acquire(name, client)
+            started = time.monotonic()
+            released = []
+
+            def release():
+                if not released:
+                    released.append(True)
+                    admission_controller.release(name, client, time.monotonic() - started)
+
+            try:
+                response = app.make_response(fn(*args, **kwargs))
+            except BaseException:
+                release()
+                raise
+            if response.is_streamed:
+                response.call_on_close(release)
+            else:
+                release()
+            return response
+        return wrapper
+    return decorator
+
+
+@app.errorhandler(AdmissionRejected)
+def _admission_rejected(e):
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.status_code = e.status_code
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+# --- التنسيق بين النسخ --- #
+
+class LocalCoordinationStore:
+    """
+    مخزن مفتاح/قيمة بصلاحية في SQLite (القيم JSON). يكفي لنسخة واحدة أو لعدة نسخ على نفس
+    الجهاز أو تتشارك نفس القرص. مدخلات الكاشات (EVICTABLE) تُحذف الأقرب انتهاءً أولًا عند تجاوز max_bytes.
+    """
+
+    backend = "local"
+    EVICTABLE = ("metadata:", "transcript-")
+
+    def __init__(self, path, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS coordination ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM coordination WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json_loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO coordination (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json_dumps_bytes(value), expires_at),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM coordination WHERE key = ?", (key,))
+
+    def purge(self):
+        """يحذف المدخلات المنتهية، ثم مدخلات الكاشات الأقرب انتهاءً حتى ينزل الحجم تحت max_bytes."""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM coordination WHERE expires_at <= ?", (time.time(),)).rowcount
+            if not self.max_bytes:
+                return removed
+            evictable = " OR ".join("key LIKE ?" for _ in self.EVICTABLE)
+            patterns = [prefix + "%" for prefix in self.EVICTABLE]
+            total = self._conn.execute(
+                f"SELECT COALESCE(SUM(LENGTH(value)), 0) FROM coordination WHERE {evictable}", patterns
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return removed
+            rows = self._conn.execute(
+                f"SELECT key, LENGTH(value) FROM coordination WHERE {evictable}"
+                " ORDER BY expires_at IS NULL, expires_at", patterns
+            ).fetchall()
+            victims = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM coordination WHERE key = ?", victims)
+            self.evictions += len(victims)
+            return removed + len(victims)
+
+
+class RedisCoordinationStore:
+    """
+    نفس واجهة LocalCoordinationStore فوق Redis (أو أي خادم متوافق مع بروتوكوله) لنسخ على أجهزة
+    مختلفة. client أي كائن بواجهة redis.Redis (get/set/delete)، مثل بديل محلي عند الاختبار.
+    """
+
+    backend = "redis"
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, prefix):
+        if redis is None:
+            raise RuntimeError("COORDINATION_BACKEND=redis requires the 'redis' package.")
+        return cls(redis.Redis.from_url(url, socket_timeout=HTTP_TIMEOUT), prefix)
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return json_loads(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json_dumps_bytes(value), ex=max(1, math.ceil(ttl)) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def purge(self):
+        return 0  # Redis يحذف المفاتيح المنتهية بنفسه، والحجم يُحدّ عبر maxmemory في الخادم
+
+
+# ترويسة تُضاف للطلبات الممرَّرة بين النسخ (تمنع تمرير الطلب مرة ثانية)، وترويسات الطلب والرد التي تُنقل
+FORWARDED_NODE_HEADER = "X-Forwarded-Node"
+FORWARD_REQUEST_HEADERS = ("Content-Type", "Accept", "Range", "If-Range", "If-None-Match", "If-Modified-Since")
+FORWARD_RESPONSE_HEADERS = (
+    "Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "Content-Disposition",
+    "ETag", "Last-Modified", "Cache-Control", "Location", "Retry-After", "X-Chunks-Done", "X-Chunks-Total",
+)
+
+
+class Coordinator:
+    """
+    يربط النسخ عبر مخزن مشترك: كل نسخة تعلن رابطها (node:<id>)، وتنشر حالة مهامها (job:<id>)
+    وأماكن ملفات مخزنها (artifact:<key>)، وتتشارك كاش البيانات والتفريغ النصي.
+    مجلدات التنزيل تحمل اسم النسخة المالكة (<node_id>~<uuid>)، فأي نسخة تستطيع تمرير طلب
+    /api/serve إليها. أخطاء المخزن لا توقف الطلبات: تُسجَّل ويكمل التطبيق محليًا.
+    """
+
+    PUBLISH_INTERVAL = 1.0  # أقل فاصل (بالثواني) بين نشر تحديثات تقدّم نفس المهمة
+
+    def __init__(self, store, node_id, node_url, ttl):
+        self.store = store
+        self.node_id = node_id
+        self.node_url = node_url.rstrip("/")
+        self.ttl = ttl
+        self.enabled = store is not None and bool(self.node_url)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+        self.heartbeat_interval = None
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+        self.errors = 0
+        self.forwarded = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _error(self, operation, e):
+        app.logger.warning(f"Coordination store {operation} failed: {e}")
+        metrics.inc("coordination_errors_total", operation=operation)
+        with self._lock:
+            self.errors += 1
+
+    def get(self, namespace, key):
+        if not self.enabled:
+            return None
+        try:
+            value = self.store.get(f"{namespace}:{key}")
+        except Exception as e:
+            self._error("read", e)
+            return None
+        with self._lock:
+            self.reads += 1
+            self.hits += value is not None
+        return value
+
+    def set(self, namespace, key, value, ttl=None):
+        if not self.enabled:
+            return
+        try:
+            self.store.set(f"{namespace}:{key}", value, ttl or self.ttl)
+        except Exception as e:
+            self._error("write", e)
+            return
+        with self._lock:
+            self.writes += 1
+
+    def delete(self, namespace, key):
+        if not self.enabled:
+            return
+        try:
+            self.store.delete(f"{namespace}:{key}")
+        except Exception as e:
+            self._error("delete", e)
+
+    # النسخ
+
+    def heartbeat(self):
+        self.set("node", self.node_id, {"url": self.node_url, "seen": time.time()}, ttl=3 * self.heartbeat_interval)
+
+    def start(self, interval):
+        self.heartbeat_interval = interval
+        self.heartbeat()
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.heartbeat()
+                try:
+                    self.store.purge()
+                except Exception as e:
+                    self._error("purge", e)
+        threading.Thread(target=loop, name="coordination-heartbeat", daemon=True).start()
+
+    def node_address(self, node_id):
+        """رابط نسخة أخرى حية، أو None."""
+        if node_id == self.node_id:
+            return None
+        node = self.get("node", node_id)
+        return node["url"] if node else None
+
+    def new_download_id(self):
+        download_id = str(uuid.uuid4())
+        return f"{self.node_id}~{download_id}" if self.enabled else download_id
+
+    @staticmethod
+    def download_owner(download_id):
+        return download_id.split("~", 1)[0] if "~" in download_id else None
+
+    # المهام والملفات
+
+    def publish_job(self, job, ttl, force=True):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not force and now - job.published_at < self.PUBLISH_INTERVAL:
+            return
+        job.published_at = now
+        self.set("job", job.id, {**job.to_dict(), "node": self.node_id}, ttl=ttl)
+
+    def job(self, job_id):
+        return self.get("job", job_id)
+
+    def publish_artifact(self, store_key):
+        self.set("artifact", store_key, {"node": self.node_id})
+
+    def forget_artifact(self, store_key):
+        """يحذف سجل الملف إذا كان لهذه النسخة (بعد أن حذفه منظّف القرص)، فلا تُمرَّر إليها طلباته."""
+        entry = self.get("artifact", store_key)
+        if entry and entry["node"] == self.node_id:
+            self.delete("artifact", store_key)
+
+    def artifact_node(self, store_key):
+        """النسخة الأخرى التي في مخزنها ملف لهذا المفتاح، أو None."""
+        entry = self.get("artifact", store_key)
+        return entry["node"] if entry and entry["node"] != self.node_id else None
+
+    def forward(self, node_id):
+        """
+        يمرّر الطلب الحالي إلى النسخة node_id ويبث ردّها كما هو. يعيد None إذا كانت النسخة غير
+        معروفة أو لا ترد، أو إذا كان الطلب ممرَّرًا أصلًا من نسخة أخرى (منعًا للحلقات).
+        """
+        if not self.enabled or request.headers.get(FORWARDED_NODE_HEADER):
+            return None
+        address = self.node_address(node_id)
+        if not address:
+            return None
+        headers = {name: request.headers[name] for name in FORWARD_REQUEST_HEADERS if name in request.headers}
+        headers[FORWARDED_NODE_HEADER] = self.node_id
+        target = address + request.path
+        if request.query_string:
+            target += "?" + request.query_string.decode("latin-1")
+        try:
+            upstream = self.session.request(
+                request.method, target, data=request.get_data(), headers=headers,
+                stream=True, timeout=HTTP_TIMEOUT, allow_redirects=False,
+            )
+        except requests.RequestException as e:
+            self._error("forward", e)
+            return None
+        with self._lock:
+            self.forwarded += 1
+
+        response = app.response_class(upstream.iter_content(STREAM_CHUNK_SIZE), status=upstream.status_code)
+        for name in FORWARD_RESPONSE_HEADERS:
+            if name in upstream.headers:
+                response.headers[name] = upstream.headers[name]
+        response.headers["X-Served-By-Node"] = node_id
+        response.call_on_close(upstream.close)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": self.store.backend if self.store is not None else None,
+                "node_id": self.node_id,
+                "node_url": self.node_url,
+                "reads": self.reads,
+                "hits": self.hits,
+                "writes": self.writes,
+                "errors": self.errors,
+                "forwarded": self.forwarded,
+                "store_evictions": getattr(self.store, "evictions", 0),
+            }
+
+
+def make_coordination_store(backend):
+    if backend == "redis":
+        return RedisCoordinationStore.from_url(COORDINATION_REDIS_URL, COORDINATION_PREFIX)
+    return LocalCoordinationStore(COORDINATION_PATH, COORDINATION_MAX_BYTES)
+
+
+coordinator = Coordinator(
+    make_coordination_store(COORDINATION_BACKEND) if NODE_URL else None, NODE_ID, NODE_URL, COORDINATION_TTL
+)
+metrics.describe("coordination_errors_total", "counter", "Failed coordination store operations.")
+if coordinator.enabled and multiprocessing.parent_process() is None:
+    coordinator.start(NODE_HEARTBEAT)
+
+
+# --- ترجمة ملفات VTT --- #
+
+class VttCue:
+    """
+    كتلة توقيت واحدة في ملف VTT. نحتفظ بأرقام أسطر النص داخل الملف الأصلي
+    حتى نعيد بناءه دون لمس التوقيتات أو المعرّفات أو حدود الكتل.
+    """
+
+    __slots__ = ("identifier", "timing", "text_line_numbers")
+
+    def __init__(self, identifier, timing):
+        self.identifier = identifier
+        self.timing = timing
+        self.text_line_numbers = []
+
+
+class TranslationMemory:
+    """
+    ذاكرة ترجمة دائمة في SQLite، مفتاحها (بصمة النص، لغة المصدر، لغة الهدف).
+    عند تجاوز max_entries تُحذف الأسطر الأقدم استخدامًا.
+    """
+
+    EVICT_EVERY = 500  # نفحص الحجم بعد كل هذا العدد من الإضافات
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " text_hash TEXT NOT NULL, source_lang TEXT NOT NULL, target_lang TEXT NOT NULL,"
+            " translated TEXT NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (text_hash, source_lang, target_lang))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, texts, source_lang, target_lang):
+        """يعيد قاموس {النص: الترجمة} للأسطر الموجودة في الذاكرة."""
+        hashes = {self._hash(t): t for t in texts}
+        found = {}
+        with self._lock:
+            items = list(hashes)
+            for i in range(0, len(items), 500):
+                chunk = items[i:i + 500]
+                rows = self._conn.execute(
+                    "SELECT text_hash, translated FROM translations WHERE source_lang = ? AND target_lang = ?"
+                    f" AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [source_lang, target_lang, *chunk],
+                ).fetchall()
+                for text_hash, translated in rows:
+                    found[hashes[text_hash]] = translated
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE translations SET last_used = ? WHERE text_hash = ? AND source_lang = ? AND target_lang = ?",
+                    [(now, self._hash(t), source_lang, target_lang) for t in found],
+                )
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def store(self, translations, source_lang, target_lang):
+        if not translations:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                [(self._hash(t), source_lang, target_lang, tr, now) for t, tr in translations.items()],
+            )
+            self._inserts += len(translations)
+            if self._inserts >= self.EVICT_EVERY:
+                self._inserts = 0
+                self._evict_locked()
+
+    def _evict_locked(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM translations WHERE rowid IN"
+                " (SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": count,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+translation_memory = TranslationMemory(TRANSLATION_MEMORY_PATH, TRANSLATION_MEMORY_MAX_ENTRIES)
+
+
+class CueTranslationStore:
+    """
+    يحفظ آخر نسخة مترجمة من كل مسار ترجمة (فيديو، لغة المصدر، لغة الهدف، آلي/يدوي) كقائمة كتل:
+    (بداية، نهاية، بصمة النص، الأسطر المترجمة). يُخزَّن في نفس ملف SQLite لذاكرة الترجمة.
+    عند تجاوز max_tracks تُحذف المسارات الأقدم استخدامًا.
+    """
+
+    def __init__(self, path, max_tracks):
+        self.max_tracks = max_tracks
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cue_translations ("
+            " track_key TEXT NOT NULL, start_ms INTEGER NOT NULL, end_ms INTEGER NOT NULL,"
+            " text_hash TEXT NOT NULL, translated TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cue_translations_track ON cue_translations (track_key)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cue_tracks (track_key TEXT PRIMARY KEY, last_used REAL NOT NULL)"
+        )
+
+    def load(self, track_key):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT start_ms, end_ms, text_hash, translated FROM cue_translations WHERE track_key = ?",
+                (track_key,),
+            ).fetchall()
+            if rows:
+                self._conn.execute("UPDATE cue_tracks SET last_used = ? WHERE track_key = ?", (time.time(), track_key))
+        return [(start, end, text_hash, json.loads(translated)) for start, end, text_hash, translated in rows]
+
+    def save(self, track_key, entries):
+        """يستبدل النسخة المحفوظة للمسار بـ entries."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._replace_locked(track_key, entries)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _replace_locked(self, track_key, entries):
+        self._conn.execute("DELETE FROM cue_translations WHERE track_key = ?", (track_key,))
+        self._conn.executemany(
+            "INSERT INTO cue_translations VALUES (?, ?, ?, ?, ?)",
+            [(track_key, start, end, text_hash, json.dumps(translated, ensure_ascii=False))
+             for start, end, text_hash, translated in entries],
+        )
+        self._conn.execute("INSERT OR REPLACE INTO cue_tracks VALUES (?, ?)", (track_key, time.time()))
+        self._conn.execute(
+            "DELETE FROM cue_translations WHERE track_key IN"
+            " (SELECT track_key FROM cue_tracks ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_tracks,),
+        )
+        self._conn.execute(
+            "DELETE FROM cue_tracks WHERE track_key IN"
+            " (SELECT track_key FROM cue_tracks ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_tracks,),
+        )
+
+    def stats(self):
+        with self._lock:
+            (tracks,) = self._conn.execute("SELECT COUNT(*) FROM cue_tracks").fetchone()
+            (cues,) = self._conn.execute("SELECT COUNT(*) FROM cue_translations").fetchone()
+        return {"tracks": tracks, "cues": cues}
+
+
+cue_translation_store = CueTranslationStore(TRANSLATION_MEMORY_PATH, SUBTITLE_VERSIONS_MAX_TRACKS)
+
+
+def normalize_lang(lang):
+    """يوحّد رمز اللغة لمفتاح ذاكرة الترجمة (en-US و en-orig تصبح en)."""
+    return (lang or "auto").split("-")[0].lower()
+
+
+translate_pool = ThreadPoolExecutor(max_workers=max(1, TRANSLATE_WORKERS), thread_name_prefix="translate")
+
+
+def parse_vtt(vtt_content: str):
+    """
+    يحلّل محتوى VTT ويعيد (الأسطر، قائمة VttCue). رأس الملف وكتل NOTE/STYLE/REGION
+    تبقى كما هي ولا تُترجم.
+    """
+    lines = vtt_content.splitlines()
+    cues = []
+    current = None
+    block_start = 0
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped == "":
+            current = None
+            block_start = i + 1
+        elif "-->" in line:
+            # سطر التوقيت؛ السطر السابق داخل نفس الكتلة (إن وجد) هو المعرّف
+            identifier = lines[i - 1] if i > block_start else None
+            current = VttCue(identifier, line)
+            cues.append(current)
+        elif current is not None and not stripped.isdigit():
+            current.text_line_numbers.append(i)
+    return lines, cues
+
+
+def _translate_batch(texts, target_lang):
+    """
+    يترجم مجموعة أسطر بطلب واحد (مفصولة بسطر جديد)، مع إعادة المحاولة والتأخير المتزايد.
+    إذا لم يتطابق عدد الأسطر الناتجة نترجم كل سطر وحده، والسطر الذي تفشل ترجمته يُعاد كـ None.
+    """
+    if len(texts) > 1:
+        for attempt in range(TRANSLATE_RETRIES):
+            try:
+                translated = translator.translate("\n".join(texts), dest=target_lang).text.split("\n")
+                if len(translated) == len(texts):
+                    return translated
+                break
+            except Exception:
+                if attempt + 1 < TRANSLATE_RETRIES:
+                    time.sleep(TRANSLATE_BACKOFF * (2 ** attempt) + random.uniform(0, TRANSLATE_BACKOFF))
+
+    results = []
+    for text in texts:
+        for attempt in range(TRANSLATE_RETRIES):
+            try:
+                results.append(translator.translate(text, dest=target_lang).text)
+                break
+            except Exception:
+                if attempt + 1 < TRANSLATE_RETRIES:
+                    time.sleep(TRANSLATE_BACKOFF * (2 ** attempt) + random.uniform(0, TRANSLATE_BACKOFF))
+        else:
+            results.append(None)
+    return results
+
+
+def _make_batches(cues, lines, batch_chars, skip=()):
+    """
+    يجمع نصوص الكتل في دفعات لا يتجاوز حجمها batch_chars، دون تقسيم كتلة بين دفعتين.
+    النصوص المكررة أو الموجودة في skip لا تُضاف.
+    """
+    batches = []
+    current, size, seen = [], 0, set(skip)
+    for cue in cues:
+        texts = [lines[n] for n in cue.text_line_numbers if lines[n] not in seen]
+        if not texts:
+            continue
+        seen.update(texts)
+        cue_size = sum(len(t) + 1 for t in texts)
+        if current and size + cue_size > batch_chars:
+            batches.append(current)
+            current, size = [], 0
+        current.extend(texts)
+        size += cue_size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_vtt_and_translate(vtt_content: str, target_lang: str, source_lang: str = "auto",
+                            batch_chars: int = None, workers: int = None, use_memory: bool = True) -> str:
+    """
+    يستقبل محتوى ملف VTT كنص، ثم يترجم أسطر الحوار إلى اللغة target_lang،
+    ويعيد نص VTT جديد مع الترجمة.
+    الأسطر الموجودة في ذاكرة الترجمة لا تُرسل للمترجم، والباقي يُجمع في دفعات
+    (TRANSLATE_BATCH_CHARS) تُترجم بالتوازي في المجموعة المشتركة (TRANSLATE_WORKERS)، أو في
+    مجموعة خاصة بحجم workers إن أُعطي.
+    """
+    source_lang = normalize_lang(source_lang)
+    lines, cues = parse_vtt(vtt_content)
+    translations = _translate_cue_lines(lines, cues, target_lang, source_lang, batch_chars, workers, use_memory)
+
+    output_lines = list(lines)
+    for cue in cues:
+        for n in cue.text_line_numbers:
+            output_lines[n] = translations.get(lines[n], lines[n])
+    return "\n".join(output_lines)
+
+
+def _translate_cue_lines(lines, cues, target_lang, source_lang, batch_chars=None, workers=None, use_memory=True):
+    """
+    يترجم أسطر النص في cues ويعيد قاموس {السطر: الترجمة}؛ الأسطر التي فشلت ترجمتها لا تظهر فيه.
+    """
+    batch_chars = TRANSLATE_BATCH_CHARS if batch_chars is None else batch_chars
+    texts = {lines[n] for cue in cues for n in cue.text_line_numbers}
+    translations = translation_memory.lookup(texts, source_lang, target_lang) if use_memory else {}
+    batches = _make_batches(cues, lines, batch_chars, skip=translations)
+
+    new_translations = {}
+    if workers is None:
+        # المجموعة المشتركة تحدّ عدد طلبات الترجمة المتوازية على مستوى الخادم كله؛
+        # workers صريح (حتى لو ساوى TRANSLATE_WORKERS) يعني مجموعة خاصة بهذا الطلب
+        results = translate_pool.map(lambda b: _translate_batch(b, target_lang), batches)
+    else:
+        pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="translate")
+        results = list(pool.map(lambda b: _translate_batch(b, target_lang), batches))
+        pool.shutdown()
+    for batch, translated in zip(batches, results):
+        new_translations.update((t, tr) for t, tr in zip(batch, translated) if tr is not None)
+    if use_memory:
+        translation_memory.store(new_translations, source_lang, target_lang)
+    translations.update(new_translations)
+    return translations
+
+
+TIMESTAMP_RE = re.compile(r"(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{3})")
+
+
+def _cue_span_ms(cue):
+    """بداية ونهاية الكتلة بالمللي ثانية من سطر التوقيت."""
+    stamps = TIMESTAMP_RE.findall(cue.timing)
+    values = [
+        ((int(h or 0) * 60 + int(m)) * 60 + int(sec)) * 1000 + int(ms) for h, m, sec, ms in stamps[:2]
+    ]
+    return (values + [0, 0])[:2]
+
+
+def translate_vtt_incremental(vtt_content: str, target_lang: str, source_lang: str, track_key: str):
+    """
+    مثل parse_vtt_and_translate، لكن يقارن الكتل بآخر نسخة مترجمة من نفس المسار (track_key):
+    الكتلة التي لها نفس بصمة النص وتوقيت قريب (ضمن SUBTITLE_ALIGN_TOLERANCE_MS) تأخذ ترجمتها
+    السابقة، ولا يُرسل للمترجم إلا الكتل الجديدة أو المتغيرة. يعيد (نص VTT، إحصاءات).
+    """
+    source_lang = normalize_lang(source_lang)
+    lines, cues = parse_vtt(vtt_content)
+
+    previous = {}
+    for start, end, text_hash, translated in cue_translation_store.load(track_key):
+        previous.setdefault(text_hash, []).append([start, translated, False])
+
+    cue_info, reused, pending = [], {}, []
+    for i, cue in enumerate(cues):
+        texts = [lines[n] for n in cue.text_line_numbers]
+        start, end = _cue_span_ms(cue)
+        text_hash = hashlib.sha256("\n".join(texts).encode("utf-8")).hexdigest()
+        cue_info.append((start, end, text_hash))
+        if not texts:
+            continue
+        # أقرب كتلة غير مستخدمة بنفس النص
+        candidates = [c for c in previous.get(text_hash, ())
+                      if not c[2] and abs(c[0] - start) <= SUBTITLE_ALIGN_TOLERANCE_MS and len(c[1]) == len(texts)]
+        if candidates:
+            match = min(candidates, key=lambda c: abs(c[0] - start))
+            match[2] = True
+            reused[i] = match[1]
+        else:
+            pending.append(cue)
+
+    translations = _translate_cue_lines(lines, pending, target_lang, source_lang)
+
+    output_lines = list(lines)
+    entries = []
+    for i, cue in enumerate(cues):
+        if i in reused:
+            translated, complete = reused[i], True
+        else:
+            translated = [translations.get(lines[n]) for n in cue.text_line_numbers]
+            complete = None not in translated
+            translated = [tr if tr is not None else lines[n] for tr, n in zip(translated, cue.text_line_numbers)]
+        for n, text in zip(cue.text_line_numbers, translated):
+            output_lines[n] = text
+        # الكتل التي فشلت ترجمة بعض أسطرها لا تُحفظ حتى تُترجم في المرة القادمة
+        if cue.text_line_numbers and complete:
+            entries.append((*cue_info[i], translated))
+    cue_translation_store.save(track_key, entries)
+
+    stats = {"cues_total": len(cues), "cues_reused": len(reused), "cues_translated": len(pending)}
+    return "\n".join(output_lines), stats
+
+
+# --- محرك yt-dlp --- #
+
+class JobCancelled(Exception):
+    """تُرمى عندما يُلغى تنفيذ مهمة أثناء عملها."""
+
+
+class JobError(Exception):
+    """خطأ متوقَّع داخل مهمة؛ رسالته تُعرض للعميل كما هي في حقل error."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# قالب تقدّم yt-dlp بصيغة يسهل تحليلها (سطر لكل تحديث مع --newline)
+PROGRESS_PREFIX = "__progress__"
+PROGRESS_TEMPLATE = (
+    f"download:{PROGRESS_PREFIX} %(progress.downloaded_bytes)s %(progress.total_bytes)s "
+    "%(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s"
+)
+
+def progress_info(downloaded, total, speed, eta):
+    """
+    يبني قاموس التقدّم (النسبة والسرعة والوقت المتبقي) من قيم yt-dlp.
+    """
+    percent = round(downloaded * 100.0 / total, 1) if downloaded and total else None
+    return {
+        "stage": "downloading",
+        "percent": percent,
+        "downloaded_bytes": int(downloaded) if downloaded else 0,
+        "total_bytes": int(total) if total else None,
+        "speed": float(speed) if speed else None,
+        "eta": int(eta) if eta is not None else None,
+    }
+
+def parse_progress_line(line):
+    """
+    يحلّل سطر التقدّم الناتج عن PROGRESS_TEMPLATE، ويعيد None لباقي الأسطر.
+    """
+    if line.startswith("[Merger]"):
+        return {"stage": "merging"}
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    values = []
+    for value in line[len(PROGRESS_PREFIX):].split():
+        try:
+            values.append(float(value))
+        except ValueError:
+            values.append(None)
+    if len(values) != 5:
+        return None
+    downloaded, total, total_estimate, speed, eta = values
+    return progress_info(downloaded, total or total_estimate, speed, eta)
+
+
+class _YtDlpLogger:
+    """يجمع رسائل الخطأ من yt_dlp لتظهر في stderr كما في سطر الأوامر."""
+
+    def __init__(self):
+        self.errors = []
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+
+class InProcessEngine:
+    """
+    يشغّل yt-dlp عبر مكتبة yt_dlp.YoutubeDL من مجموعة خيوط دافئة، بدل تشغيل مفسّر Python
+    جديد واستيراد yt-dlp وتهيئة المستخرجات في كل طلب.
+    الأخطاء تُحوَّل إلى نفس استثناءات subprocess حتى تبقى معالجة الأخطاء في نقاط النهاية كما هي.
+    """
+
+    def __init__(self, workers):
+        import yt_dlp  # نستورده مرة واحدة عند الإنشاء
+        self._yt_dlp = yt_dlp
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="yt-dlp", initializer=self._warm_up
+        )
+
+    def _options(self, args):
+        parsed = self._yt_dlp.parse_options(args)
+        opts = dict(parsed.ydl_opts)
+        opts.update(quiet=True, noprogress=True, logger=_YtDlpLogger())
+        return opts, parsed.urls
+
+    def _warm_up(self):
+        # YoutubeDL واحد لكل خيط للاستخراج: يحتفظ بالمستخرجات المهيّأة وكاش ملفات المشغّل
+        opts, _ = self._options(["--skip-download", "--no-warnings"])
+        self._local.extractor = self._yt_dlp.YoutubeDL(opts)
+
+    def _extract(self, url):
+        ydl = self._local.extractor
+        ydl.params["logger"].errors.clear()
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info)
+
+    def _download(self, args, on_progress, cancel_event):
+        opts, urls = self._options(args)
+
+        def progress_hook(d):
+            if cancel_event.is_set():
+                raise self._yt_dlp.utils.DownloadCancelled()
+            if on_progress and d.get("status") == "downloading":
+                on_progress(progress_info(
+                    d.get("downloaded_bytes"),
+                    d.get("total_bytes") or d.get("total_bytes_estimate"),
+                    d.get("speed"),
+                    d.get("eta"),
+                ))
+
+        def postprocessor_hook(d):
+            if on_progress and d.get("postprocessor") == "Merger" and d.get("status") == "started":
+                on_progress({"stage": "merging"})
+
+        opts["progress_hooks"] = [progress_hook]
+        opts["postprocessor_hooks"] = [postprocessor_hook]
+        with self._yt_dlp.YoutubeDL(opts) as ydl:
+            retcode = ydl.download(urls)
+        if cancel_event.is_set():
+            raise JobCancelled()
+        if retcode:
+            raise self._yt_dlp.utils.DownloadError("\n".join(opts["logger"].errors))
+
+    def _call(self, args, timeout, cancel_event, fn, *fn_args):
+        future = self._pool.submit(fn, *fn_args)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # لا يمكن إيقاف الخيط قسرًا؛ نطلب الإلغاء فيتوقف التنزيل عند تحديث التقدّم التالي
+            if cancel_event is not None:
+                cancel_event.set()
+            future.cancel()
+            raise subprocess.TimeoutExpired(["yt-dlp"] + args, timeout)
+        except self._yt_dlp.utils.DownloadCancelled:
+            raise JobCancelled()
+        except self._yt_dlp.utils.DownloadError as e:
+            raise subprocess.CalledProcessError(1, ["yt-dlp"] + args, output="", stderr=str(e))
+
+    def extract_info(self, url, timeout):
+        return self._call([url], timeout, None, self._extract, url)
+
+    def run(self, args, timeout, on_progress=None, cancel_event=None):
+        cancel_event = cancel_event or threading.Event()
+        self._call(args, timeout, cancel_event, self._download, args, on_progress, cancel_event)
+
+
+yt_dlp_engine = None
+if YTDLP_ENGINE == "inprocess":
+    try:
+        yt_dlp_engine = InProcessEngine(YTDLP_ENGINE_WORKERS)
+    except ImportError as e:
+        app.logger.warning(f"yt_dlp module not available, falling back to subprocess engine: {e}")
+
+
+def _run_yt_dlp_process(command, timeout, on_progress, cancel_event):
+    """
+    يشغّل yt-dlp كعملية مع قراءة التقدّم سطرًا بسطر، ويقتلها عند الإلغاء أو انتهاء المهلة.
+    """
+    command = command[:1] + ["--newline", "--progress-template", PROGRESS_TEMPLATE] + command[1:]
+    proc = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1
+    )
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+
+    state = {"timed_out": False, "cancelled": False}
+
+    def watchdog():
+        deadline = time.monotonic() + timeout
+        while proc.poll() is None:
+            if cancel_event is not None and cancel_event.wait(0.2):
+                state["cancelled"] = True
+                proc.kill()
+            elif cancel_event is None:
+                time.sleep(0.2)
+            if time.monotonic() > deadline:
+                state["timed_out"] = True
+                proc.kill()
+
+    threading.Thread(target=watchdog, daemon=True).start()
+    for line in proc.stdout:
+        progress = parse_progress_line(line.strip())
+        if progress and on_progress:
+            on_progress(progress)
+    proc.wait()
+    stderr_reader.join()
+    stderr = "".join(stderr_chunks)
+
+    if state["cancelled"]:
+        raise JobCancelled()
+    if state["timed_out"]:
+        raise subprocess.TimeoutExpired(command, timeout, stderr=stderr)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command, output="", stderr=stderr)
+
+
+def run_yt_dlp(args, timeout, on_progress=None, cancel_event=None, operation="download"):
+    """
+    يشغّل yt-dlp بالمعاملات args (بدون اسم البرنامج) عبر المحرك المختار في YTDLP_ENGINE.
+    on_progress يستقبل قاموس التقدّم، وcancel_event يوقف التنزيل ويرمي JobCancelled.
+    يرمي subprocess.TimeoutExpired أو subprocess.CalledProcessError عند الفشل في كلا المحركين.
+    operation يُستخدم كتسمية في مقاييس /metrics فقط.
+    """
+    with track_subprocess("yt-dlp", operation):
+        if yt_dlp_engine is not None:
+            return yt_dlp_engine.run(args, timeout, on_progress=on_progress, cancel_event=cancel_event)
+        command = [get_yt_dlp_path()] + args
+        if on_progress is None and cancel_event is None:
+            subprocess.run(command, capture_output=True, text=True, check=True, timeout=timeout)
+        else:
+            _run_yt_dlp_process(command, timeout, on_progress, cancel_event)
+
+
+# --- مهام الخلفية --- #
+
+class Job:
+    """مهمة خلفية واحدة مع حالتها وتقدّمها ونتيجتها."""
+
+    def __init__(self, kind, key=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.key = key  # مفتاح إزالة التكرار: طلبات بنفس المفتاح تنضم لنفس المهمة الجارية
+        self.tickets = set()  # تذكرة لكل طلب منضم للمهمة؛ الإلغاء الفعلي عند إلغاء آخرها
+        self.status = "queued"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.partial = None  # نتائج جزئية تُقرأ أثناء التنفيذ (مثل مقاطع التفريغ المكتملة)
+        self.timings = {}  # مجموع زمن كل مرحلة (بالثواني)
+        self._stage_started = None
+        self.publish = None  # ينشر الحالة في مخزن التنسيق (يضبطه JobManager)
+        self.published_at = 0.0
+
+    @property
+    def requesters(self):
+        return len(self.tickets)
+
+    def update_progress(self, progress):
+        # كل تغيير في stage ينهي المرحلة السابقة ويسجّل زمنها في المقاييس
+        stage = progress.get("stage")
+        previous = self.progress.get("stage")
+        if stage and stage != previous:
+            now = time.monotonic()
+            if previous and self._stage_started is not None:
+                seconds = now - self._stage_started
+                self.timings[previous] = round(self.timings.get(previous, 0) + seconds, 3)
+                record_stage(self.kind, previous, seconds)
+            self._stage_started = now
+        self.progress = {**self.progress, **progress}
+        if self.publish is not None:
+            self.publish(self, force=False)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    ينفّذ المهام الطويلة (مثل التنزيل) في مجموعة خيوط محدودة، فيتحرر خيط HTTP فورًا.
+    """
+
+    FINAL_STATES = ("finished", "failed", "cancelled")
+
+    def __init__(self, workers, retention, max_queued=0, retry_after=30, coordinator=None):
+        self.retention = retention
+        self.coordinator = coordinator
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self.attached = 0
+
+    def _prune_locked(self):
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.status in self.FINAL_STATES and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, kind, fn, *args, key=None):
+        """
+        ينشئ مهمة ويضعها في الطابور. fn تُستدعى بالشكل fn(job, *args) وتعيد نتيجة قابلة لـ JSON.
+        إذا أُعطي key وكانت هناك مهمة غير منتهية بنفس المفتاح نعيدها بدل إنشاء مهمة جديدة.
+        إذا امتلأ الطابور (max_queued) يرمي AdmissionRejected بدل قبول مهمة لن تبدأ قريبًا.
+        يعيد (job, ticket): التذكرة خاصة بهذا الطلب ويُلغى بها انضمامه وحده (انظر cancel).
+        """
+        ticket = uuid.uuid4().hex
+        with self._lock:
+            self._prune_locked()
+            if key is not None:
+                existing = self._by_key.get(key)
+                if existing is not None and existing.status not in self.FINAL_STATES:
+                    self.attached += 1
+                    existing.tickets.add(ticket)
+                    return existing, ticket
+            if self.max_queued and sum(j.status == "queued" for j in self._jobs.values()) >= self.max_queued:
+                metrics.inc("admission_rejected_total", workload="jobs", status=503)
+                raise AdmissionRejected("Job queue is full. Please retry later.", 503, self.retry_after)
+            job = Job(kind, key)
+            job.tickets.add(ticket)
+            job.publish = self._publish
+            self._jobs[job.id] = job
+            if key is not None:
+                self._by_key[key] = job
+        self._publish(job)
+        job.future = self._pool.submit(self._run, job, fn, args)
+        return job, ticket
+
+    def complete(self, kind, result):
+        """يسجّل مهمة منتهية فورًا (مثلًا عندما تكون النتيجة جاهزة في المخزن)."""
+        job = Job(kind)
+        job.status = "finished"
+        job.result = result
+        job.started_at = job.finished_at = job.created_at
+        job.progress = {"stage": "done", "percent": 100.0}
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self._publish(job)
+        return job
+
+    def _publish(self, job, force=True):
+        # الحالة تُنشر للنسخ الأخرى حتى يعمل /api/jobs/<id> من أي نسخة خلف موزّع الحمل
+        if self.coordinator is not None:
+            self.coordinator.publish_job(job, self.retention, force)
+
+    def _release_key(self, job):
+        if job.key is not None:
+            with self._lock:
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+
+    def _run(self, job, fn, args):
+        if job.cancel_event.is_set():
+            # أُلغيت بعد أن أخذها خيط العامل وقبل أن تبدأ (فلم ينجح future.cancel)
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            self._release_key(job)
+            self._publish(job)
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        self._publish(job)
+        try:
+            job.result = fn(job, *args)
+            job.status = "finished"
+        except JobCancelled:
+            job.status = "cancelled"
+        except JobError as e:
+            job.error = str(e)
+            job.status = "failed"
+        except Exception as e:
+            app.logger.error(f"Job {job.id} ({job.kind}) failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            self._release_key(job)
+            self._publish(job)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id, ticket=None):
+        """
+        يلغي انضمام الطلب صاحب ticket للمهمة؛ المهمة نفسها لا تتوقف إلا عند إلغاء آخر تذكرة.
+        تكرار الإلغاء بنفس التذكرة لا يغيّر شيئًا. دون تذكرة يُقبل الإلغاء فقط إذا لم تكن المهمة
+        مشتركة، وإلا يرمي JobError (409).
+        """
+        job = self.get(job_id)
+        if job is None or job.status in self.FINAL_STATES:
+            return job
+        with self._lock:
+            if ticket is None:
+                if len(job.tickets) > 1:
+                    raise JobError("This job is shared by several requests; cancel it with your ticket.", 409)
+                job.tickets.clear()
+            else:
+                job.tickets.discard(ticket)
+            if job.tickets:
+                return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # لم تبدأ بعد: نلغيها مباشرة من الطابور
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            self._release_key(job)
+            self._publish(job)
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def in_flight(self):
+        """عدد المهام غير المنتهية حسب (النوع، الحالة)."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                if job.status not in self.FINAL_STATES:
+                    counts[(job.kind, job.status)] = counts.get((job.kind, job.status), 0) + 1
+        return counts
+
+
+jobs = JobManager(DOWNLOAD_CONCURRENCY, JOB_RETENTION, JOB_QUEUE_MAX, JOB_QUEUE_RETRY_AFTER, coordinator)
+
+
+# --- مخزن الملفات حسب المحتوى --- #
+
+class ArtifactStore:
+    """
+    يخزّن كل ملف ناتج مرة واحدة في مجلد اسمه بصمة (الفيديو، الصيغة، إعدادات الدمج).
+    مجلدات التنزيل لكل طلب تحصل على روابط صلبة (hard links) إلى نفس الملف، فلا يزيد
+    استهلاك القرص ولا التنزيل من المصدر مع تكرار نفس الطلب.
+    """
+
+    def __init__(self, folder, shared=None):
+        self.folder = folder
+        self.shared = shared
+        self.hits = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def lookup(self, key, count_hit=True):
+        """يعيد مسار الملف المخزّن للمفتاح، أو None."""
+        directory = os.path.join(self.folder, key)
+        try:
+            names = [n for n in os.listdir(directory) if os.path.isfile(os.path.join(directory, n))]
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        os.utime(directory)  # آخر استخدام
+        if count_hit:
+            with self._lock:
+                self.hits += 1
+        return os.path.join(directory, names[0])
+
+    def temp_dir(self, key):
+        path = os.path.join(self.folder, f"{key}.tmp-{uuid.uuid4().hex}")
+        os.makedirs(path)
+        return path
+
+    def commit(self, key, temp_dir):
+        """ينقل المجلد المؤقت إلى مكانه النهائي بعملية rename ذرية ويعيد مسار الملف."""
+        directory = os.path.join(self.folder, key)
+        try:
+            os.rename(temp_dir, directory)
+            with self._lock:
+                self.stores += 1
+        except OSError:
+            # سبقنا تنزيل آخر لنفس المحتوى؛ نستخدم نسخته
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        path = self.lookup(key, count_hit=False)
+        if path is not None and self.shared is not None:
+            # تعلم النسخ الأخرى أن الملف هنا فتمرّر إلينا الطلبات المتطابقة بدل تنزيله مرة ثانية
+            self.shared.publish_artifact(key)
+        return path
+
+    @staticmethod
+    def link_into(path, dest_dir, name):
+        """ينشئ رابطًا صلبًا للملف داخل مجلد تنزيل (أو رابطًا رمزيًا إن لم يدعمه نظام الملفات)."""
+        os.makedirs(dest_dir, exist_ok=True)
+        dest = os.path.join(dest_dir, name)
+        try:
+            os.link(path, dest)
+        except OSError:
+            os.symlink(path, dest)
+        return dest
+
+    def stats(self):
+        entries, total = 0, 0
+        for name in os.listdir(self.folder):
+            directory = os.path.join(self.folder, name)
+            if ".tmp-" in name or not os.path.isdir(directory):
+                continue
+            entries += 1
+            for f in os.listdir(directory):
+                try:
+                    total += os.path.getsize(os.path.join(directory, f))
+                except OSError:
+                    pass
+        with self._lock:
+            return {"entries": entries, "bytes": total, "hits": self.hits, "stores": self.stores}
+
+
+artifact_store = ArtifactStore(ARTIFACT_STORE_FOLDER, coordinator)
+
+
+# --- منظّف القرص --- #
+
+class StorageJanitor:
+    """
+    يحذف مجلدات التنزيل ومدخلات المخزن في الخلفية: أولًا ما تجاوز max_age منذ آخر استخدام،
+    ثم الأقدم استخدامًا (آخر خدمة عبر serve_file) حتى ينزل الحجم إلى low_water × max_bytes
+    عند تجاوز max_bytes. المجلدات المحجوزة عبر in_use (قيد الكتابة) لا تُحذف أبدًا،
+    وكذلك المجلدات التي تنشئها new_folder داخل دالة مزخرفة بـ holding حتى تنتهي الدالة.
+    الحجم يُحسب لكل ملف فعلي مرة واحدة، لأن مجلدات التنزيل روابط صلبة لملفات المخزن.
+    """
+
+    def __init__(self, download_folder, store_folder, max_bytes, low_water, max_age, on_store_evict=None):
+        self.download_folder = download_folder
+        self.store_folder = store_folder
+        self.on_store_evict = on_store_evict  # يُستدعى بمفتاح المخزن بعد حذف مدخله
+        self._tasks = []
+        self.max_bytes = max_bytes
+        self.low_water_bytes = int(max_bytes * low_water)
+        self.max_age = max_age
+        self._in_use = {}
+        self._last_access = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self.runs = 0
+        self.evictions = 0
+        self.expired = 0
+        self.bytes_reclaimed = 0
+        self.usage_bytes = 0
+        self.last_run_seconds = 0.0
+
+    @contextlib.contextmanager
+    def in_use(self, path):
+        self.hold(path)
+        try:
+            yield
+        finally:
+            self.release(path)
+
+    def holding(self, fn):
+        """مزخرف: المجلدات التي تُنشأ بـ new_folder أثناء تنفيذ fn تبقى محجوزة حتى تعود fn."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            scopes = self._local.__dict__.setdefault("scopes", [])
+            scopes.append([])
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                for path in scopes.pop():
+                    self.release(path)
+        return wrapper
+
+    def new_folder(self, path):
+        """
+        ينشئ المجلد بعد حجزه، فلا يراه المنظّف فارغًا غير محجوز بين الإنشاء والحجز.
+        يُستدعى داخل دالة مزخرفة بـ holding، ويُحرَّر الحجز عند عودتها.
+        """
+        scopes = getattr(self._local, "scopes", None)
+        if not scopes:
+            raise RuntimeError("new_folder() must be called from a function decorated with holding")
+        self.hold(path)
+        scopes[-1].append(path)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def hold(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            self._in_use[path] = self._in_use.get(path, 0) + 1
+
+    def release(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            count = self._in_use.get(path, 0) - 1
+            if count > 0:
+                self._in_use[path] = count
+            else:
+                self._in_use.pop(path, None)
+            self._last_access[path] = time.time()
+
+    def touch(self, path):
+        """يسجّل آخر استخدام للمجلد (ويحدّث mtime حتى يبقى الترتيب بعد إعادة التشغيل)."""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._last_access[path] = time.time()
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _units(self):
+        """المجلدات القابلة للحذف مع آخر استخدام لكل منها."""
+        units = []
+        for parent, skip_tmp in ((self.download_folder, False), (self.store_folder, True)):
+            try:
+                names = os.listdir(parent)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                path = os.path.abspath(os.path.join(parent, name))
+                if name.startswith(".") or not os.path.isdir(path):
+                    continue
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                # مجلدات .tmp- في المخزن تنزيلات جارية؛ لا تُحذف إلا إذا تُركت أكثر من max_age
+                if skip_tmp and ".tmp-" in name and mtime > time.time() - self.max_age:
+                    continue
+                units.append([max(mtime, self._last_access.get(path, 0)), path])
+        return units
+
+    @staticmethod
+    def _inodes(path):
+        inodes = {}
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    st = os.lstat(os.path.join(root, f))
+                except OSError:
+                    continue
+                inodes[(st.st_dev, st.st_ino)] = st.st_size
+        return inodes
+
+    def _remove(self, path):
+        """يحذف المجلد ويعيد عدد البايتات المحرَّرة فعلًا (ملفات لم يبقَ لها رابط آخر)."""
+        reclaimed = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    st = os.lstat(os.path.join(root, f))
+                except OSError:
+                    continue
+                if st.st_nlink <= 1:
+                    reclaimed += st.st_size
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._last_access.pop(path, None)
+        name = os.path.basename(path)
+        if (self.on_store_evict is not None and ".tmp-" not in name
+                and os.path.dirname(path) == os.path.abspath(self.store_folder)):
+            self.on_store_evict(name)
+        return reclaimed
+
+    def run_once(self):
+        started = time.monotonic()
+        listed_at = time.time()
+        units = self._units()
+        # release يسجّل آخر استخدام لأي مسار (حتى مفاتيح مخزن غير موجودة ومجلدات .tmp- انتهت)؛
+        # نُبقي فقط ما زال موجودًا أو ما سُجّل بعد بدء هذه الجولة
+        live = {path for _, path in units}
+        with self._lock:
+            for path in [p for p, t in self._last_access.items() if p not in live and t < listed_at]:
+                del self._last_access[path]
+        inodes = {}
+        for _, path in units:
+            inodes.update(self._inodes(path))
+        usage = sum(inodes.values())
+
+        now = time.time()
+        over_budget = usage > self.max_bytes
+        units.sort()
+        for unit in units:
+            last_access, path = unit
+            with self._lock:
+                busy = path in self._in_use
+            if busy:
+                continue
+            expired = last_access < now - self.max_age
+            if not expired and (not over_budget or usage <= self.low_water_bytes):
+                break
+            reclaimed = self._remove(path)
+            usage -= reclaimed
+            with self._lock:
+                self.evictions += 1
+                self.expired += int(expired)
+                self.bytes_reclaimed += reclaimed
+
+        with self._lock:
+            self.runs += 1
+            self.usage_bytes = usage
+            self.last_run_seconds = round(time.monotonic() - started, 3)
+
+    def add_task(self, fn):
+        """fn() تُستدعى في كل جولة بعد تنظيف التنزيلات (مثل تنظيف كاش داخل .cache)."""
+        self._tasks.append(fn)
+
+    def start(self, interval):
+        def loop():
+            while not self._stop.wait(interval):
+                for task in [self.run_once] + self._tasks:
+                    try:
+                        task()
+                    except Exception as e:
+                        app.logger.error(f"Storage janitor run failed: {e}", exc_info=True)
+        threading.Thread(target=loop, name="storage-janitor", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "usage_bytes": self.usage_bytes,
+                "max_bytes": self.max_bytes,
+                "low_water_bytes": self.low_water_bytes,
+                "in_use": len(self._in_use),
+                "runs": self.runs,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "bytes_reclaimed": self.bytes_reclaimed,
+                "last_run_seconds": self.last_run_seconds,
+            }
+
+
+storage_janitor = StorageJanitor(
+    DOWNLOAD_FOLDER, ARTIFACT_STORE_FOLDER, GC_MAX_BYTES, GC_LOW_WATER, GC_MAX_AGE,
+    on_store_evict=coordinator.forget_artifact,
+)
+if GC_ENABLED and multiprocessing.parent_process() is None:
+    storage_janitor.start(GC_INTERVAL)
+
+
+# --- نماذج Whisper --- #
+
+def format_timestamp(sec: float):
+    hours = int(sec // 3600)
+    minutes = int((sec % 3600) // 60)
+    seconds = sec % 60
+    return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
+
+
+def segments_to_vtt(segments):
+    """
+    يبني محتوى WebVTT من مقاطع Whisper (start/end/text).
+    """
+    vtt_lines = ["WEBVTT\n"]
+    for i, segment in enumerate(segments, start=1):
+        vtt_lines.append(str(i))
+        vtt_lines.append(f"{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}")
+        vtt_lines.append(segment["text"].strip())
+        vtt_lines.append("")  # سطر فارغ بين الكتل
+    return "\n".join(vtt_lines)
+
+
+class WhisperModelManager:
+    """
+    يحتفظ بنماذج Whisper المحمّلة ضمن ميزانية ذاكرة، ويفرّغ الأقدم استخدامًا عند التجاوز.
+    كل حجم نموذج يُحمَّل مرة واحدة حتى مع الطلبات المتزامنة، وعدد عمليات التفريغ
+    المتوازية محدود بـ semaphore مع ضبط عدد خيوط torch لكل عملية بحيث يساوي المجموع عدد الأنوية.
+    """
+
+    # استهلاك تقريبي للذاكرة (MB) لكل نموذج على المعالج
+    MODEL_MEMORY_MB = {"tiny": 150, "base": 300, "small": 1000, "medium": 3000, "large": 6000}
+
+    def __init__(self, allowed, memory_budget_mb, concurrency=0, loader=None):
+        cores = os.cpu_count() or 1
+        self.allowed = allowed
+        self.loader = loader
+        self.memory_budget_mb = memory_budget_mb
+        self.concurrency = concurrency or max(1, cores // 4)
+        self.threads_per_job = max(1, cores // self.concurrency)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {size: threading.Lock() for size in allowed}
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._torch_configured = False
+        self.loads = 0
+        self.unloads = 0
+        self.active = 0
+
+    def _load_model(self, size):
+        if self.loader is not None:
+            return self.loader(size)
+        import whisper  # استيراد متأخر: يستورد torch وهو بطيء
+        if not self._torch_configured:
+            import torch
+            torch.set_num_threads(self.threads_per_job)
+            self._torch_configured = True
+        return whisper.load_model(size)
+
+    def _memory_locked(self):
+        return sum(self.MODEL_MEMORY_MB.get(size, 0) for size in self._models)
+
+    def get(self, size):
+        """يعيد النموذج المطلوب، ويحمّله إن لم يكن محمّلًا."""
+        if size not in self.allowed:
+            raise ValueError(f"Unsupported model size '{size}'. Allowed: {', '.join(self.allowed)}")
+        with self._lock:
+            if size in self._models:
+                self._models.move_to_end(size)
+                return self._models[size]
+        with self._load_locks[size]:
+            with self._lock:
+                if size in self._models:
+                    return self._models[size]
+            model = self._load_model(size)
+            with self._lock:
+                self._models[size] = model
+                self.loads += 1
+                while len(self._models) > 1 and self._memory_locked() > self.memory_budget_mb:
+                    oldest = next(iter(self._models))
+                    if oldest == size:
+                        break
+                    del self._models[oldest]
+                    self.unloads += 1
+            return model
+
+    def preload(self, sizes):
+        """يحمّل النماذج في خيط خلفي حتى لا يدفع أول طلب زمن التحميل."""
+        def run():
+            for size in sizes:
+                try:
+                    self.get(size)
+                except Exception as e:
+                    app.logger.warning(f"Could not preload Whisper model '{size}': {e}")
+        threading.Thread(target=run, name="whisper-preload", daemon=True).start()
+
+    def transcribe(self, size, audio, **kwargs):
+        model = self.get(size)
+        with self._semaphore:
+            with self._lock:
+                self.active += 1
+            try:
+                return model.transcribe(audio, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": list(self._models),
+                "memory_mb": self._memory_locked(),
+                "memory_budget_mb": self.memory_budget_mb,
+                "concurrency": self.concurrency,
+                "threads_per_job": self.threads_per_job,
+                "active": self.active,
+                "loads": self.loads,
+                "unloads": self.unloads,
+            }
+
+
+def load_callable(spec):
+    """يحوّل "module:function" إلى الدالة المقابلة، أو None إن كانت القيمة فارغة."""
+    if not spec:
+        return None
+    module_name, sep, attr = spec.partition(":")
+    if not sep or not module_name or not attr:
+        raise ValueError(f"Expected 'module:function', got '{spec}'")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+whisper_models = WhisperModelManager(
+    WHISPER_MODELS, WHISPER_MEMORY_BUDGET_MB, WHISPER_CONCURRENCY, loader=load_callable(WHISPER_MODEL_LOADER)
+)
+# عمليات التفريغ (spawn) تعيد استيراد هذا الملف عند تشغيله مباشرة؛ لا نحمّل فيها النماذج مسبقًا
+if WHISPER_PRELOAD and multiprocessing.parent_process() is None:
+    whisper_models.preload(WHISPER_PRELOAD)
+
+chunked_transcriber = ChunkedTranscriber(
+    TRANSCRIBE_PROCESSES, TRANSCRIBE_CHUNK_SECONDS, TRANSCRIBE_MAX_CHUNK_SECONDS
+) if TRANSCRIBE_CHUNKED else None
+_clamped_process_counts = set()
+
+
+def transcribe_process_count(model_size):
+    """
+    عدد القطع التي تُفرَّغ بالتوازي بنموذج model_size: TRANSCRIBE_PROCESSES مقيّدًا بحيث
+    العمليات × ذاكرة النموذج ≤ WHISPER_MEMORY_BUDGET_MB. يُسجَّل تحذير أول مرة يُقيَّد فيها العدد.
+    """
+    requested = chunked_transcriber.processes
+    per_model = WhisperModelManager.MODEL_MEMORY_MB.get(model_size, 1000)
+    count = max(1, min(requested, whisper_models.memory_budget_mb // per_model))
+    if count < requested and model_size not in _clamped_process_counts:
+        _clamped_process_counts.add(model_size)
+        app.logger.warning(
+            f"Chunked transcription with '{model_size}' limited to {count} of {requested} processes "
+            f"by WHISPER_MEMORY_BUDGET_MB={whisper_models.memory_budget_mb}"
+        )
+    return count
+
+
+def chunked_parallelism(pcm, model_size):
+    """
+    كيف يُفرَّغ الصوت: 0 = دفعة واحدة (صوت قصير أو التقسيم معطّل)، 1 = قطع متتالية داخل العملية
+    بالنموذج المُدار، 2 فأكثر = قطع متوازية في مجموعة العمليات (التي تحمّل نماذجها بنفسها).
+    """
+    if chunked_transcriber is None or len(pcm) < TRANSCRIBE_CHUNKED_MIN_SECONDS * SAMPLE_RATE:
+        return 0
+    return transcribe_process_count(model_size)
+
+
+def transcribe_pcm(job, pcm, model_size):
+    """
+    يفرّغ الصوت (PCM بتردد 16 kHz). الصوت الطويل يُقسَّم عند الصمت ويُفرَّغ على قطع (بالتوازي
+    في عمليات منفصلة إن سمحت الذاكرة)، والمقاطع المكتملة تُنشر في job.partial أثناء العمل.
+    الصوت القصير يُفرَّغ بنموذج WhisperModelManager مباشرة.
+    """
+    parallel = chunked_parallelism(pcm, model_size)
+    if not parallel:
+        return whisper_models.transcribe(model_size, pcm, verbose=False, word_timestamps=False)
+
+    def on_partial(segments, done, total):
+        if job.cancel_event.is_set():
+            raise JobCancelled()
+        job.partial = {"segments": segments, "chunks_done": done, "chunks_total": total}
+        job.update_progress({"stage": "transcribing", "percent": round(done * 100.0 / total, 1)})
+
+    if parallel == 1:
+        return chunked_transcriber.transcribe_in_process(
+            pcm, functools.partial(whisper_models.transcribe, model_size),
+            on_partial=on_partial, verbose=False, word_timestamps=False,
+        )
+    return chunked_transcriber.transcribe(
+        pcm, model_size, on_partial=on_partial, parallel=parallel, verbose=False, word_timestamps=False
+    )
+
+
+def pick_transcription_audio_format(info):
+    """
+    يختار من الصيغ الصوتية المستخرجة مسبقًا أصغر صيغة بمعدل بت لا يقل عن TRANSCRIBE_AUDIO_MIN_ABR.
+    يعيد None إن لم توجد صيغة صوت فقط (مثل كثير من فيديوهات تويتر).
+    """
+    candidates = info.get("audio_formats") or []
+    if not candidates:
+        return None
+    adequate = [f for f in candidates if (f.get("abr") or 0) >= TRANSCRIBE_AUDIO_MIN_ABR] or candidates
+    return min(adequate, key=lambda f: (f.get("filesize") or float("inf"), f.get("abr") or 0))
+
+
+def stream_transcription_audio(url, timeout=300, cancel_event=None):
+    """
+    يمرّر أصغر صيغة صوتية كافية من yt-dlp إلى ffmpeg مباشرة ويعيد (pcm, stats)،
+    أو None إن لم تتوفر صيغة صوت فقط. يرمي JobCancelled إذا ضُبط cancel_event أثناء البث.
+    يستخدم برنامج yt-dlp دائمًا مهما كانت قيمة YTDLP_ENGINE، لأن البث يحتاج أنبوبًا إلى ffmpeg.
+    """
+    audio_format = pick_transcription_audio_format(fetch_video_info(url))
+    if audio_format is None:
+        return None
+    command = [
+        get_yt_dlp_path(),
+        "-f", audio_format["format_id"],
+        "-o", "-",
+        "--quiet",
+        "--no-warnings",
+        "--no-playlist",
+        url
+    ]
+    with track_subprocess("yt-dlp+ffmpeg", "audio-stream"):
+        try:
+            pcm, stats = stream_audio_pcm(command, timeout, cancel_event=cancel_event)
+        except StreamCancelled:
+            raise JobCancelled()
+    stats["format_id"] = audio_format["format_id"]
+    return pcm, stats
+
+
+# --- كاش التفريغ النصي --- #
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """
+    يخزّن مقاطع Whisper (بلغة المصدر) على القرص كملفات JSON، مفتاحها بصمة محتوى الصوت
+    وحجم النموذج. ملف صغير لكل (فيديو، نموذج) يشير إلى بصمة الصوت، فيمكن تخطي تنزيل
+    الصوت والتفريغ معًا عند الترجمة إلى لغة ثانية.
+    عند تجاوز max_bytes تُحذف الملفات الأقدم استخدامًا (حسب mtime). مع shared (Coordinator)
+    تُنشر المدخلات للنسخ الأخرى، والمدخل الذي تجده نسخة في المخزن المشترك تنسخه لقرصها.
+    """
+
+    def __init__(self, folder, max_bytes, shared=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._lock = threading.Lock()
+        self.video_hits = 0
+        self.audio_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, kind, key, model_size):
+        name = hashlib.sha1(f"{key}:{model_size}".encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, f"{kind}-{name}.json")
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # آخر استخدام، لترتيب الحذف
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, entry):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _lookup(self, kind, key, model_size):
+        path = self._path(kind, key, model_size)
+        entry = self._read(path)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(f"transcript-{kind}", f"{key}:{model_size}")
+            if entry is not None:
+                try:
+                    self._write(path, entry)
+                except OSError as e:
+                    app.logger.warning(f"Could not write transcript cache entry: {e}")
+        return entry
+
+    def _publish(self, kind, key, model_size, entry):
+        if self.shared is not None:
+            self.shared.set(f"transcript-{kind}", f"{key}:{model_size}", entry, ttl=COORDINATION_TRANSCRIPT_TTL)
+
+    def get_by_video(self, video_key, model_size):
+        ref = self._lookup("video", video_key, model_size)
+        entry = self._lookup("audio", ref["audio_sha256"], model_size) if ref else None
+        if entry is not None:
+            with self._lock:
+                self.video_hits += 1
+        return entry
+
+    def get_by_audio(self, audio_sha256, model_size):
+        entry = self._lookup("audio", audio_sha256, model_size)
+        with self._lock:
+            if entry is not None:
+                self.audio_hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def link_video(self, video_key, audio_sha256, model_size):
+        """يربط فيديو بتفريغ موجود لنفس الصوت."""
+        try:
+            self._write(self._path("video", video_key, model_size), {"audio_sha256": audio_sha256})
+        except OSError as e:
+            app.logger.warning(f"Could not write transcript cache entry: {e}")
+        self._publish("video", video_key, model_size, {"audio_sha256": audio_sha256})
+
+    def put(self, video_key, audio_sha256, model_size, result):
+        entry = {
+            "video_key": video_key,
+            "audio_sha256": audio_sha256,
+            "model_size": model_size,
+            "language": result.get("language"),
+            "segments": [
+                {"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+                for seg in result["segments"]
+            ],
+            "created_at": time.time(),
+        }
+        try:
+            self._write(self._path("audio", audio_sha256, model_size), entry)
+            self._evict()
+        except OSError as e:
+            app.logger.warning(f"Could not write transcript cache entry: {e}")
+        self._publish("audio", audio_sha256, model_size, entry)
+        self.link_video(video_key, audio_sha256, model_size)
+        return entry
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".json"):
+                try:
+                    st = os.stat(os.path.join(self.folder, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, name))
+        return files
+
+    def _evict(self):
+        with self._lock:
+            files = sorted(self._files())
+            total = sum(size for _, size, _ in files)
+            for _, size, name in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        files = self._files()
+        with self._lock:
+            lookups = self.video_hits + self.audio_hits + self.misses
+            return {
+                "entries": sum(1 for _, _, name in files if name.startswith("audio-")),
+                "bytes": sum(size for _, size, _ in files),
+                "video_hits": self.video_hits,
+                "audio_hits": self.audio_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.video_hits + self.audio_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+transcript_cache = TranscriptCache(
+    os.path.join(CACHE_FOLDER, "transcripts"), TRANSCRIPT_CACHE_MAX_BYTES, shared=coordinator
+)
+
+
+# --- كاش بيانات الفيديو --- #
+
+class _InFlight:
+    """طلب استخراج جارٍ ينتظره باقي الطلبات لنفس المفتاح."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MetadataCache:
+    """
+    كاش LRU في الذاكرة مع TTL لكل عنصر، وطبقة اختيارية على القرص، وطبقة مشتركة اختيارية
+    بين النسخ (shared: Coordinator).
+    الطلبات المتزامنة لنفس المفتاح تنتظر استخراجًا واحدًا بدل أن يبدأ كلٌّ منها استخراجه.
+    ملفات القرص تحمل وقت انتهاء صلاحيتها في mtime، فيكفي purge_disk قراءة stat لتنظيفها.
+    """
+
+    def __init__(self, max_entries, default_ttl, disk_folder=None, ttl_for=None, shared=None,
+                 disk_max_bytes=0):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.disk_folder = disk_folder
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_for = ttl_for
+        self.shared = shared
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if disk_folder:
+            os.makedirs(disk_folder, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _read_disk(self, key):
+        if not self.disk_folder:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = json_loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["expires_at"], entry["value"]
+
+    def _write_disk(self, key, expires_at, value):
+        if not self.disk_folder:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(json_dumps_bytes({"key": key, "expires_at": expires_at, "value": value}))
+            os.utime(tmp_path, (expires_at, expires_at))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            app.logger.warning(f"Could not write metadata cache entry to disk: {e}")
+
+    def purge_disk(self):
+        """
+        يحذف من القرص المدخلات المنتهية صلاحيتها والملفات المؤقتة المتروكة، ثم الأقرب انتهاءً
+        حتى ينزل الحجم إلى disk_max_bytes (0 = دون حد). يعيد عدد الملفات المحذوفة.
+        """
+        if not self.disk_folder:
+            return 0
+        now = time.time()
+        files, removed = [], 0
+        for name in os.listdir(self.disk_folder):
+            path = os.path.join(self.disk_folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # mtime = وقت الانتهاء للملفات المكتملة؛ الملف المؤقت عالق إذا مرّت ساعة على كتابته
+            stale = name.endswith(".tmp") and st.st_ctime + 3600 <= now
+            if stale or (name.endswith(".json") and st.st_mtime <= now):
+                removed += self._remove_disk(path)
+            elif name.endswith(".json"):
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if self.disk_max_bytes:
+            for _, size, path in sorted(files):
+                if total <= self.disk_max_bytes:
+                    break
+                removed += self._remove_disk(path)
+                total -= size
+        with self._lock:
+            self.disk_evictions += removed
+        return removed
+
+    @staticmethod
+    def _remove_disk(path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def _read_shared(self, key):
+        if self.shared is None:
+            return None
+        entry = self.shared.get("metadata", key)
+        if entry is None or entry["expires_at"] <= time.time():
+            return None
+        self._write_disk(key, entry["expires_at"], entry["value"])
+        return entry["expires_at"], entry["value"]
+
+    def _evict_locked(self):
+        # نحذف المنتهية صلاحيتها أولًا (روابط موقّعة انتهت)، ثم الأقدم استخدامًا
+        now = time.time()
+        if len(self._entries) > self.max_entries:
+            for key in [k for k, (exp, _) in self._entries.items() if exp <= now]:
+                del self._entries[key]
+                self.evictions += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        return None
+
+    def get(self, key):
+        with self._lock:
+            value = self._get_locked(key)
+        if value is not None:
+            return value
+        entry = self._read_disk(key)
+        from_disk = entry is not None
+        if entry is None:
+            # استخرجته نسخة أخرى خلف موزّع الحمل
+            entry = self._read_shared(key)
+            if entry is None:
+                return None
+        with self._lock:
+            if from_disk:
+                self.disk_hits += 1
+            else:
+                self.shared_hits += 1
+            self._entries[key] = entry
+            self._evict_locked()
+        return entry[1]
+
+    def set(self, key, value):
+        ttl = self.ttl_for(value) if self.ttl_for else self.default_ttl
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            self._evict_locked()
+        self._write_disk(key, expires_at, value)
+        if self.shared is not None:
+            self.shared.set("metadata", key, {"expires_at": expires_at, "value": value}, ttl=ttl)
+
+    def get_or_load(self, key, loader):
+        """
+        يعيد القيمة من الكاش، أو يستدعي loader مرة واحدة فقط مهما كان عدد الطلبات المتزامنة.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                self._inflight[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.set(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.shared_hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "in_flight": len(self._inflight),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_ratio": round(
+                    (self.hits + self.disk_hits + self.shared_hits + self.coalesced) / lookups, 4
+                ) if lookups else 0.0,
+            }
+
+
+def video_info_ttl(info):
+    """
+    مدة صلاحية بيانات الفيديو: لا تتجاوز أقرب انتهاء لروابط download_url الموقّعة.
+    """
+    expiries = [url_expiry(f.get("download_url")) for f in info.get("formats", [])]
+    expiries = [e for e in expiries if e]
+    if not expiries:
+        return METADATA_CACHE_TTL
+    return min(METADATA_CACHE_TTL, min(expiries) - METADATA_URL_EXPIRY_MARGIN - time.time())
+
+
+metadata_cache = MetadataCache(
+    METADATA_CACHE_SIZE,
+    METADATA_CACHE_TTL,
+    disk_folder=os.path.join(CACHE_FOLDER, "metadata") if METADATA_CACHE_DISK else None,
+    ttl_for=video_info_ttl,
+    shared=coordinator,
+    disk_max_bytes=METADATA_CACHE_DISK_MAX_BYTES,
+)
+# طبقة القرص لا يراها منظّف التنزيلات (.cache)، فيُنظّفها في جولاته
+storage_janitor.add_task(metadata_cache.purge_disk)
+
+
+# الحقول التي يستخدمها build_video_info من كل صيغة؛ الباقي (fragments، تفاصيل الترميز...) يُهمل فور التحليل
+VIDEO_FORMAT_FIELDS = (
+    "format_id", "format_note", "ext", "vcodec", "acodec", "height", "abr", "tbr", "asr",
+    "filesize", "filesize_approx", "url", "http_headers",
+)
+# الحقول العامة التي يستخدمها build_video_info؛ تُنسخ فقط إن وُجدت
+VIDEO_TOP_LEVEL_FIELDS = ("title", "thumbnail", "uploader", "original_url", "extractor_key")
+
+
+def _pick_caption_track(tracks):
+    track = next((t for t in tracks if t.get("ext") == "vtt"), tracks[0])
+    # المفاتيح الغائبة تبقى غائبة حتى تعمل القيم الافتراضية في build_video_info (مثل name=lang)
+    return {k: track[k] for k in ("name", "url", "ext") if k in track}
+
+
+def project_video_data(data):
+    """
+    يُبقي من مخرجات yt-dlp (عدة ميغابايت للفيديوهات الطويلة) الحقول التي يحتاجها build_video_info فقط:
+    حقول VIDEO_FORMAT_FIELDS لكل صيغة، ونسخة واحدة (vtt إن وجدت) لكل لغة ترجمة.
+    """
+    def captions(key):
+        return {
+            lang: [_pick_caption_track(tracks)]
+            for lang, tracks in (data.get(key) or {}).items() if tracks
+        }
+
+    return {
+        **{k: data[k] for k in VIDEO_TOP_LEVEL_FIELDS if k in data},
+        "formats": [
+            {field: f[field] for field in VIDEO_FORMAT_FIELDS if field in f}
+            for f in data.get("formats") or []
+        ],
+        "subtitles": captions("subtitles"),
+        "automatic_captions": captions("automatic_captions"),
+    }
+
+
+def extract_video_data(url):
+    """
+    يستدعي yt-dlp لإخراج JSON دون تحميل الفيديو ويعيد الحقول المطلوبة منه كـ dict.
+    """
+    if yt_dlp_engine is not None:
+        with timed_stage("video-info", "extract"), track_subprocess("yt-dlp", "extract"):
+            data = yt_dlp_engine.extract_info(url, timeout=60)
+        with timed_stage("video-info", "parse"):
+            return project_video_data(data)
+
+    command = [
+        get_yt_dlp_path(),
+        "--dump-json",
+        "--skip-download",
+        "--no-warnings",
+        url
+    ]
+    # نقرأ المخرجات كـ bytes ونحللها مباشرة دون نسخة نصية وسيطة
+    with timed_stage("video-info", "extract"), track_subprocess("yt-dlp", "extract"):
+        result = subprocess.run(command, capture_output=True, timeout=60)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(
+                result.returncode, command, output="", stderr=result.stderr.decode("utf-8", "replace")
+            )
+    with timed_stage("video-info", "parse"):
+        return project_video_data(json_loads(result.stdout))
+
+
+def build_video_info(video_data, url):
+    """
+    يبني استجابة /api/video-info من مخرجات yt-dlp.
+    """
+    title = video_data.get("title", "N/A")
+    thumbnail = video_data.get("thumbnail", None)
+    uploader = video_data.get("uploader", "N/A")
+    original_url = video_data.get("original_url", url)
+
+    # 1) اكتشاف المنصة بناءً على extractor_key أو عنوان URL
+    lower_url = url.lower()
+    extractor = video_data.get("extractor_key", "").lower()
+    if ("twitter.com" in lower_url) or ("x.com" in lower_url) or any(k in extractor for k in ("twitter", "x", "xcom")):
+        platform = "twitter"
+    else:
+        platform = "youtube"
+
+    # 2) استخراج الصيغ (formats)
+    formats = []
+    for f in video_data.get("formats", []):
+        fmt_id = f.get("format_id", "")
+        vcodec = f.get("vcodec", "none")
+        acodec = f.get("acodec", "none")
+        url_f = f.get("url")
+
+        if vcodec != "none" and url_f and (f.get("format_note") or f.get("height")):
+            # بناء نص الدقة
+            if f.get("format_note"):
+                resolution = f.get("format_note")
+            else:
+                h = f.get("height")
+                resolution = f"{h}p" if h else "N/A"
+
+            # الحجم (filesize) من yt-dlp إن وجد، أو تقريبًا
+            filesize = f.get("filesize") or f.get("filesize_approx") or 0
+
+            formats.append({
+                "format_id": fmt_id,
+                "resolution": resolution,
+                "height": f.get("height", 0),
+                "ext": f.get("ext", ""),
+                "vcodec": vcodec,
+                "acodec": acodec,
+                "filesize": filesize,
+                "has_audio": (acodec != "none"),
+                "download_url": url_f,
+                "http_headers": f.get("http_headers", {})
+            })
+
+    # نرتب الصيغ بحسب الدقة تنازليًا
+    formats.sort(key=lambda x: x.get("height", 0), reverse=True)
+
+    # صيغ الصوت فقط (تُستخدم لاختيار أصغر صوت كافٍ للتفريغ)
+    audio_formats = []
+    for f in video_data.get("formats", []):
+        if f.get("vcodec", "none") == "none" and f.get("acodec", "none") != "none" and f.get("url"):
+            audio_formats.append({
+                "format_id": f.get("format_id", ""),
+                "ext": f.get("ext", ""),
+                "acodec": f.get("acodec"),
+                "abr": f.get("abr") or f.get("tbr") or 0,
+                "asr": f.get("asr"),
+                "filesize": f.get("filesize") or f.get("filesize_approx") or 0,
+            })
+
+    # 3) استخراج الترجمات المتوفرة والآلية (حتى لو فارغ)
+    subtitles = {}
+    for lang, subs in video_data.get("subtitles", {}).items():
+        vtt_sub = next((s for s in subs if s.get("ext") == "vtt"), subs[0] if subs else None)
+        if vtt_sub:
+            subtitles[lang] = {
+                "name": vtt_sub.get("name", lang),
+                "url": vtt_sub.get("url"),
+                "ext": vtt_sub.get("ext")
+            }
+
+    auto_captions = {}
+    for lang, caps in video_data.get("automatic_captions", {}).items():
+        vtt_cap = next((c for c in caps if c.get("ext") == "vtt"), caps[0] if caps else None)
+        if vtt_cap:
+            auto_captions[lang] = {
+                "name": vtt_cap.get("name", lang + " (auto)"),
+                "url": vtt_cap.get("url"),
+                "ext": vtt_cap.get("ext")
+            }
+
+    return {
+        "title": title,
+        "thumbnail": thumbnail,
+        "uploader": uploader,
+        "formats": formats,
+        "audio_formats": audio_formats,
+        "subtitles": subtitles,
+        "automatic_captions": auto_captions,
+        "original_url": original_url,
+        "platform": platform
+    }
+
+
+def _load_video_info(url):
+    video_data = extract_video_data(url)
+    with timed_stage("video-info", "build"):
+        return build_video_info(video_data, url)
+
+
+def compact_video_info(info):
+    """
+    نسخة مختصرة من استجابة /api/video-info: دون http_headers للصيغ، وقائمة رموز لغات الترجمة الآلية
+    بدل روابطها (قد تتجاوز 100 لغة).
+    """
+    return {
+        **{k: v for k, v in info.items() if k != "automatic_captions"},
+        "formats": [{k: v for k, v in f.items() if k != "http_headers"} for f in info["formats"]],
+        "automatic_caption_languages": sorted(info.get("automatic_captions") or {}),
+    }
+
+
+def fetch_video_info(url):
+    """
+    يعيد بيانات الفيديو من الكاش إن وُجدت، وإلا يستخرجها مرة واحدة ويخزّنها.
+    """
+    return metadata_cache.get_or_load(
+        video_cache_key(url),
+        lambda: _load_video_info(url),
+    )
+
+
+# --- جلب مباشر عبر HTTP --- #
+
+class DirectFetcher:
+    """
+    يجلب ملفات الترجمة والصور المصغّرة مباشرة من الروابط الموجودة في بيانات الفيديو المخزّنة،
+    عبر جلسة requests واحدة تبقي الاتصالات مفتوحة (keep-alive) بين الطلبات، بدل تشغيل yt-dlp
+    واستخراج الفيديو من جديد. يعيد None عندما لا يصلح الرابط (غير مخزّن أو منتهي الصلاحية أو فشل
+    الطلب) ليتولى yt-dlp الأمر.
+    """
+
+    def __init__(self, pool_size, timeout):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(500, 502, 503, 504)),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.direct = 0
+        self.fallbacks = 0
+        self.errors = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @staticmethod
+    def _headers(info):
+        # yt-dlp لا يعطي ترويسات خاصة بالترجمات؛ ترويسات الصيغ (User-Agent...) تصلح لها
+        for f in info.get("formats", []):
+            if f.get("http_headers"):
+                return f["http_headers"]
+        return {}
+
+    def get(self, url, headers=None):
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def subtitle(self, video_url, lang, is_auto):
+        """يعيد نص VTT للغة lang من رابط الترجمة المخزّن، أو None."""
+        info = metadata_cache.get(video_cache_key(video_url))
+        tracks = (info or {}).get("automatic_captions" if is_auto else "subtitles") or {}
+        track = tracks.get(lang)
+        if not track or track.get("ext") != "vtt" or not track.get("url"):
+            self._count("fallbacks")
+            return None
+        expires = url_expiry(track["url"])
+        if expires and expires - METADATA_URL_EXPIRY_MARGIN <= time.time():
+            self._count("fallbacks")
+            return None
+        try:
+            response = self.get(track["url"], self._headers(info))
+        except requests.RequestException as e:
+            app.logger.warning(f"Direct subtitle fetch failed, falling back to yt-dlp: {e}")
+            self._count("errors")
+            return None
+        response.encoding = "utf-8"
+        if not response.text.lstrip("\ufeff").startswith("WEBVTT"):
+            self._count("errors")
+            return None
+        self._count("direct")
+        return response.text
+
+    def stats(self):
+        with self._lock:
+            return {"direct": self.direct, "fallbacks": self.fallbacks, "errors": self.errors}
+
+
+direct_fetcher = DirectFetcher(HTTP_POOL_SIZE, HTTP_TIMEOUT)
+
+
+def fetch_subtitle_file(url, lang, is_auto, download_path, safe_title):
+    """
+    يحفظ ملف ترجمة VTT للغة lang داخل download_path ويعيد اسمه، أو None إن لم يُعثر عليه.
+    يُجرَّب الرابط المخزّن أولًا (طلب HTTP واحد)، ثم yt-dlp إن لم يصلح.
+    يرمي subprocess.TimeoutExpired أو subprocess.CalledProcessError عند فشل yt-dlp.
+    """
+    vtt_content = direct_fetcher.subtitle(url, lang, is_auto)
+    if vtt_content is not None:
+        filename = f"{safe_title}.{lang}.vtt"
+        with open(os.path.join(download_path, filename), "w", encoding="utf-8") as f:
+            f.write(vtt_content)
+        return filename
+
+    output_template = os.path.join(download_path, f"{safe_title}.{lang}.%(ext)s")
+    command = [
+        "--write-auto-subs" if is_auto else "--write-subs",
+        "--skip-download",
+        "--sub-langs", lang,
+        "--sub-format", "vtt",
+        "-o", output_template,
+        "--no-warnings",
+        "--no-playlist",
+        url
+    ]
+    run_yt_dlp(command, timeout=120, operation="subtitles")
+
+    vtt_files = [
+        f for f in os.listdir(download_path)
+        if os.path.isfile(os.path.join(download_path, f)) and f.endswith(".vtt")
+    ]
+    return vtt_files[0] if vtt_files else None
+
+
+# --- الطلبات المجمّعة --- #
+
+class FanOutScheduler:
+    """
+    يوزّع عناصر الطلبات المجمّعة على مجموعة خيوط مشتركة محدودة (BATCH_WORKERS)، مع حد أقصى
+    للطلبات المتزامنة لكل منصة (BATCH_PER_HOST) مشترك بين كل الطلبات المجمّعة.
+    العنصر لا يُرسَل للمجموعة إلا إذا توفرت له سعة في منصته، فلا يحجز خيطًا وهو ينتظر.
+    """
+
+    def __init__(self, workers, per_host):
+        self.workers = workers
+        self.per_host = per_host
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def run(self, items, host_of, fn):
+        """
+        مولّد يعيد (index, result, error) لكل عنصر بترتيب الاكتمال. إغلاق المولّد (انقطاع العميل)
+        يلغي العناصر التي لم تبدأ.
+        """
+        pending = list(enumerate(items))
+        running = {}
+        try:
+            while pending or running:
+                # نرسل كل عنصر تتوفر سعة لمنصته، دون تجاوز حجم المجموعة لهذا الطلب
+                waiting = []
+                for index, item in pending:
+                    semaphore = self._semaphore(host_of(item))
+                    if len(running) < self.workers and semaphore.acquire(blocking=False):
+                        future = self._pool.submit(fn, item)
+                        future.add_done_callback(lambda _, sem=semaphore: sem.release())
+                        running[future] = index
+                    else:
+                        waiting.append((index, item))
+                pending = waiting
+
+                # المهلة تسمح بإعادة المحاولة عندما تحرر طلبات مجمّعة أخرى سعة في منصة ما
+                done, _ = wait(running, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    try:
+                        yield index, future.result(), None
+                    except Exception as e:
+                        yield index, None, e
+        finally:
+            for future in running:
+                future.cancel()
+
+
+batch_scheduler = FanOutScheduler(BATCH_WORKERS, BATCH_PER_HOST)
+
 
-def parse_vtt_and_translate(vtt_content: str, target_lang: str) -> str:
+def extract_playlist_urls(url, limit):
     """
-    يستقبل محتوى ملف VTT كنص، ثم يترجم أسطر الحوار إلى اللغة target_lang،
-    ويعيد نص VTT جديد مع الترجمة.
+    يستخرج روابط فيديوهات قائمة تشغيل أو قناة بوضع --flat-playlist (دون استخراج كل فيديو).
     """
-    lines = vtt_content.splitlines()
-    output_lines = []
-    for line in lines:
-        if "-->" in line or line.strip() == "" or line.strip().isdigit() or line.strip().upper() == "WEBVTT":
-            # سطر توقيت أو رقم كتلة أو سطر فارغ أو رأس VTT: نحتفظ به كما هو
-            output_lines.append(line)
-        else:
-            # سطر نص: نترجمه
-            try:
-                translated = translator.translate(line, dest=target_lang).text
-                output_lines.append(translated)
-            except Exception:
-                # إذا فشل الترجمة لأي سبب، نحتفظ بالنص الأصلي
-                output_lines.append(line)
-    return "\n".join(output_lines)
+    command = [
+        get_yt_dlp_path(),
+        "--flat-playlist",
+        "--dump-single-json",
+        "--playlist-end", str(limit),
+        "--no-warnings",
+        url
+    ]
+    with track_subprocess("yt-dlp", "playlist"):
+        result = subprocess.run(command, capture_output=True, text=True, check=True, timeout=120)
+    data = json.loads(result.stdout)
+    urls = []
+    for entry in data.get("entries") or [data]:
+        entry_url = entry.get("url") or entry.get("webpage_url")
+        if entry_url and not entry_url.startswith("http") and entry.get("ie_key") == "Youtube":
+            entry_url = f"https://www.youtube.com/watch?v={entry_url}"
+        if entry_url:
+            urls.append(entry_url)
+    return urls[:limit]
 
 
 # --- نقاط النهاية (Endpoints) --- #
@@ -72,6 +3115,7 @@ def hello_world():
 
 
 @app.route("/api/video-info", methods=["POST"])
+@admission("light")
 def get_video_info():
     data = request.get_json()
     url = data.get("url")
@@ -82,99 +3126,10 @@ def get_video_info():
     if not is_valid_url(url):
         return jsonify({"error": "Invalid URL. Only YouTube and Twitter/X links are supported."}), 400
 
-    yt_dlp_path = get_yt_dlp_path()
-    command = [
-        yt_dlp_path,
-        "--dump-json",
-        "--skip-download",
-        "--no-warnings",
-        url
-    ]
-
     try:
-        # نستدعي yt-dlp لإخراج JSON دون تحميل الفيديو
-        result = subprocess.run(command, capture_output=True, text=True, check=True, timeout=60)
-        video_data = json.loads(result.stdout)
-
-        title = video_data.get("title", "N/A")
-        thumbnail = video_data.get("thumbnail", None)
-        uploader = video_data.get("uploader", "N/A")
-        original_url = video_data.get("original_url", url)
-
-        # 1) اكتشاف المنصة بناءً على extractor_key أو عنوان URL
-        lower_url = url.lower()
-        extractor = video_data.get("extractor_key", "").lower()
-        if ("twitter.com" in lower_url) or ("x.com" in lower_url) or any(k in extractor for k in ("twitter", "x", "xcom")):
-            platform = "twitter"
-        else:
-            platform = "youtube"
-
-        # 2) استخراج الصيغ (formats)
-        formats = []
-        for f in video_data.get("formats", []):
-            fmt_id = f.get("format_id", "")
-            vcodec = f.get("vcodec", "none")
-            acodec = f.get("acodec", "none")
-            url_f = f.get("url")
-
-            if vcodec != "none" and url_f and (f.get("format_note") or f.get("height")):
-                # بناء نص الدقة
-                if f.get("format_note"):
-                    resolution = f.get("format_note")
-                else:
-                    h = f.get("height")
-                    resolution = f"{h}p" if h else "N/A"
-
-                # الحجم (filesize) من yt-dlp إن وجد، أو تقريبًا
-                filesize = f.get("filesize") or f.get("filesize_approx") or 0
-
-                formats.append({
-                    "format_id": fmt_id,
-                    "resolution": resolution,
-                    "height": f.get("height", 0),
-                    "ext": f.get("ext", ""),
-                    "filesize": filesize,
-                    "has_audio": (acodec != "none"),
-                    "download_url": url_f,
-                    "http_headers": f.get("http_headers", {})
-                })
-
-        # نرتب الصيغ بحسب الدقة تنازليًا
-        formats.sort(key=lambda x: x.get("height", 0), reverse=True)
-
-        # 3) استخراج الترجمات المتوفرة والآلية (حتى لو فارغ)
-        subtitles = {}
-        for lang, subs in video_data.get("subtitles", {}).items():
-            vtt_sub = next((s for s in subs if s.get("ext") == "vtt"), subs[0] if subs else None)
-            if vtt_sub:
-                subtitles[lang] = {
-                    "name": vtt_sub.get("name", lang),
-                    "url": vtt_sub.get("url"),
-                    "ext": vtt_sub.get("ext")
-                }
-
-        auto_captions = {}
-        for lang, caps in video_data.get("automatic_captions", {}).items():
-            vtt_cap = next((c for c in caps if c.get("ext") == "vtt"), caps[0] if caps else None)
-            if vtt_cap:
-                auto_captions[lang] = {
-                    "name": vtt_cap.get("name", lang + " (auto)"),
-                    "url": vtt_cap.get("url"),
-                    "ext": vtt_cap.get("ext")
-                }
-
-        response_data = {
-            "title": title,
-            "thumbnail": thumbnail,
-            "uploader": uploader,
-            "formats": formats,
-            "subtitles": subtitles,
-            "automatic_captions": auto_captions,
-            "original_url": original_url,
-            "platform": platform
-        }
-
-        return jsonify(response_data)
+        info = fetch_video_info(url)
+        # "compact": true يحذف الحقول الكبيرة التي لا تحتاجها معظم الواجهات
+        return jsonify(compact_video_info(info) if data.get("compact") else info)
 
     except subprocess.TimeoutExpired:
         return jsonify({"error": "Processing timed out. The video might be too long or the server is busy."}), 504
@@ -193,7 +3148,130 @@ def get_video_info():
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+@app.route("/api/thumbnail")
+@admission("light")
+def get_thumbnail():
+    """
+    يمرّر الصورة المصغّرة للفيديو من رابطها في البيانات المخزّنة عبر الجلسة المشتركة
+    (بنفس ترويسات yt-dlp)، حتى لا تحتاج الواجهة طلبًا مباشرًا لخوادم المنصة.
+    """
+    url = request.args.get("url")
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
+
+    if not is_valid_url(url):
+        return jsonify({"error": "Invalid URL. Only YouTube and Twitter/X links are supported."}), 400
+
+    try:
+        info = fetch_video_info(url)
+        if not info.get("thumbnail"):
+            return jsonify({"error": "This video has no thumbnail."}), 404
+        upstream = direct_fetcher.get(info["thumbnail"], DirectFetcher._headers(info))
+    except subprocess.TimeoutExpired:
+        return jsonify({"error": "Processing timed out. The video might be too long or the server is busy."}), 504
+    except subprocess.CalledProcessError as e:
+        return jsonify({"error": f"yt-dlp error: {e.stderr or ''}"}), 500
+    except requests.RequestException as e:
+        return jsonify({"error": f"Could not fetch thumbnail: {e}"}), 502
+
+    response = app.response_class(
+        upstream.content, mimetype=upstream.headers.get("Content-Type", "image/jpeg")
+    )
+    response.cache_control.public = True
+    response.cache_control.max_age = SERVE_MAX_AGE
+    return response
+
+
+@app.route("/api/batch/video-info", methods=["POST"])
+@admission("batch")
+def batch_video_info():
+    """
+    يستخرج بيانات عدة فيديوهات دفعة واحدة ويعيدها كـ NDJSON (سطر JSON لكل فيديو فور اكتماله).
+    استقبال:
+      {
+        "urls": ["<video_url>", ...],       أو
+        "playlist_url": "<playlist_or_channel_url>",
+        "limit": <max_items>,                (اختياري)
+        "compact": <true_or_false>           (اختياري: نفس شكل /api/video-info المختصر)
+      }
+    كل سطر: {"index", "url", "info"} أو {"index", "url", "error"}، والسطر الأخير {"summary": {...}}.
+    """
+    data = request.get_json()
+    urls = data.get("urls")
+    playlist_url = data.get("playlist_url")
+    compact = bool(data.get("compact"))
+    try:
+        limit = max(1, min(int(data.get("limit") or BATCH_MAX_ITEMS), BATCH_MAX_ITEMS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    if not urls and not playlist_url:
+        return jsonify({"error": "urls or playlist_url is required"}), 400
+
+    started = time.monotonic()
+    if playlist_url:
+        if not is_valid_url(playlist_url):
+            return jsonify({"error": "Invalid URL. Only YouTube and Twitter/X links are supported."}), 400
+        try:
+            urls = extract_playlist_urls(playlist_url, limit)
+        except subprocess.TimeoutExpired:
+            return jsonify({"error": "Playlist extraction timed out."}), 504
+        except subprocess.CalledProcessError as e:
+            return jsonify({"error": f"yt-dlp playlist error: {e.stderr or ''}"}), 500
+        except json.JSONDecodeError:
+            return jsonify({"error": "Failed to parse playlist data from yt-dlp."}), 500
+    elif not isinstance(urls, list):
+        return jsonify({"error": "urls must be a list"}), 400
+    urls = urls[:limit]
+    playlist_seconds = time.monotonic() - started
+
+    def host_of(url):
+        return video_cache_key(url).split(":", 1)[0]
+
+    def generate():
+        ok = failed = 0
+        valid = []
+        for index, url in enumerate(urls):
+            if isinstance(url, str) and is_valid_url(url):
+                valid.append((index, url))
+            else:
+                failed += 1
+                yield json.dumps({"index": index, "url": url, "error": "Invalid URL."}) + "\n"
+
+        results = batch_scheduler.run(valid, lambda item: host_of(item[1]), lambda item: fetch_video_info(item[1]))
+        for position, info, error in results:
+            index, url = valid[position]
+            if error is None:
+                ok += 1
+                line = {"index": index, "url": url, "info": compact_video_info(info) if compact else info}
+            else:
+                failed += 1
+                if isinstance(error, subprocess.TimeoutExpired):
+                    message = "Processing timed out."
+                elif isinstance(error, subprocess.CalledProcessError):
+                    message = f"yt-dlp error: {error.stderr or ''}"
+                else:
+                    message = str(error)
+                line = {"index": index, "url": url, "error": message}
+            yield json.dumps(line) + "\n"
+
+        seconds = time.monotonic() - started
+        yield json.dumps({"summary": {
+            "items": len(urls),
+            "ok": ok,
+            "failed": failed,
+            "playlist_seconds": round(playlist_seconds, 3),
+            "seconds": round(seconds, 3),
+            "items_per_second": round(len(urls) / seconds, 2) if seconds else 0.0,
+        }}) + "\n"
+
+    response = app.response_class(generate(), mimetype="application/x-ndjson")
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/api/download-video", methods=["POST"])
+@admission("light")
 def download_video():
     data = request.get_json()
     url = data.get("url")
@@ -203,57 +3281,414 @@ def download_video():
     if not url or not format_id:
         return jsonify({"error": "URL and format ID are required"}), 400
 
-    yt_dlp_path = get_yt_dlp_path()
-    download_id = str(uuid.uuid4())
+    # نختار الصوت والحاوية من بيانات الصيغ إن كانت في الكاش فقط؛ وإلا يتم الاستخراج والتخطيط
+    # داخل المهمة حتى لا ينتظر خيط HTTP استخراج yt-dlp. مفتاح المهمة واحد في الحالتين حتى
+    # ينضم الطلب الذي يصل بعد أن خزّنت المهمة الأولى البيانات إليها بدل بدء تنزيل ثانٍ
+    job_key = ("download-video", video_cache_key(url), format_id)
+    info = metadata_cache.get(video_cache_key(url))
+    if info is None:
+        job, ticket = jobs.submit("download-video", run_video_download, url, format_id, title, key=job_key)
+    else:
+        plan = plan_download_format(info, format_id)
+        store_key = download_store_key(url, plan)
+
+        # إذا نُزّل نفس المحتوى سابقًا نعيد رابطًا له فورًا دون تنزيل جديد
+        with storage_janitor.in_use(os.path.join(ARTIFACT_STORE_FOLDER, store_key)):
+            stored_path = artifact_store.lookup(store_key)
+            if stored_path is not None:
+                result = {**publish_artifact(stored_path, title), "format_plan": plan}
+        if stored_path is not None:
+            job, ticket = jobs.complete("download-video", result), None
+        else:
+            forwarded = forward_to_artifact_owner(store_key)
+            if forwarded is not None:
+                return forwarded
+            # التنزيل يعمل في الخلفية؛ الطلبات المتطابقة المتزامنة تنضم لنفس المهمة
+            job, ticket = jobs.submit("download-video", run_video_download, url, format_id, title, plan, key=job_key)
+
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "result": job.result,
+        **job_ticket_fields(job, ticket),
+    }), 202
+
+
+def job_ticket_fields(job, ticket):
+    """تذكرة الطلب ورابط إلغاء انضمامه للمهمة (لا شيء للمهام المنتهية فورًا)."""
+    if ticket is None:
+        return {}
+    return {"ticket": ticket, "cancel_url": f"/api/jobs/{job.id}/cancel?ticket={ticket}"}
+
+
+@storage_janitor.holding
+def publish_artifact(stored_path, title):
+    """
+    يربط ملفًا من المخزن داخل مجلد تنزيل جديد ويعيد رابط خدمته.
+    """
+    download_id = coordinator.new_download_id()
     specific_download_path = os.path.join(app.config["DOWNLOAD_FOLDER"], download_id)
-    os.makedirs(specific_download_path, exist_ok=True)
+    storage_janitor.new_folder(specific_download_path)
+    ext = os.path.splitext(stored_path)[1]
+    filename = f"{sanitize_filename(title)}{ext}"
+    ArtifactStore.link_into(stored_path, specific_download_path, filename)
+    encoded_filename = urllib.parse.quote(filename, safe="")
+    return {"download_url": f"/api/serve/{download_id}/{encoded_filename}"}
+
+
+def forward_to_artifact_owner(store_key):
+    """
+    إذا كان الملف في مخزن نسخة أخرى نمرّر الطلب إليها بدل تنزيله مرة ثانية. يعيد None إن لم
+    يكن للمفتاح مالك آخر أو تعذر الوصول إليه.
+    """
+    owner = coordinator.artifact_node(store_key)
+    return coordinator.forward(owner) if owner else None
+
+
+def _codec_family(codec):
+    return (codec or "").split(".")[0].lower()
+
+
+def plan_download_format(info, format_id):
+    """
+    يخطط تنزيل format_id من بيانات الفيديو info ويعيد
+    {"format", "merge_output_format", "container", "work", "audio_format_id"}:
+      - الصيغة فيها صوت: تُنزَّل كما هي دون دمج ("copy").
+      - وإلا: أفضل صوت يتوافق ترميزه مع الفيديو في أول حاوية من MERGE_CONTAINERS تقبلهما
+        معًا، ثم mkv التي تقبل أي ترميز؛ فيكون الدمج نسخًا مباشرًا ("remux") ولا يُعاد الترميز أبدًا.
+    إن لم تتوفر بيانات الصيغ يُستخدم DOWNLOAD_MERGE_SETTINGS ("unknown").
+    """
+    default_container = DOWNLOAD_MERGE_SETTINGS["merge_output_format"]
+    video = next((f for f in (info or {}).get("formats", []) if f.get("format_id") == format_id), None)
+    audio_formats = sorted(
+        (info or {}).get("audio_formats", []), key=lambda f: f.get("abr") or 0, reverse=True
+    )
+    if video is None or (not video.get("has_audio") and not audio_formats):
+        return {
+            "format": f"{format_id}+{DOWNLOAD_MERGE_SETTINGS['audio']}",
+            "merge_output_format": default_container,
+            "container": default_container,
+            "work": "unknown",
+            "audio_format_id": None,
+        }
+
+    if video.get("has_audio"):
+        return {
+            "format": format_id,
+            "merge_output_format": None,
+            "container": video.get("ext") or default_container,
+            "work": "copy",
+            "audio_format_id": None,
+        }
+
+    video_family = _codec_family(video.get("vcodec"))
+    for container, video_codecs, audio_codecs in MERGE_CONTAINERS:
+        # بيانات قديمة في الكاش دون vcodec: نعتمد على امتداد الفيديو
+        if video_family not in video_codecs and not (not video_family and video.get("ext") == container):
+            continue
+        audio = next((a for a in audio_formats if _codec_family(a.get("acodec")) in audio_codecs), None)
+        if audio is not None:
+            break
+    else:
+        container, audio = "mkv", audio_formats[0]
+
+    return {
+        "format": f"{format_id}+{audio['format_id']}",
+        "merge_output_format": container,
+        "container": container,
+        "work": "remux",
+        "audio_format_id": audio["format_id"],
+    }
+
+
+def download_store_key(url, plan):
+    return ArtifactStore.key(video_cache_key(url), plan["format"], plan["merge_output_format"])
+
+
+def run_video_download(job, url, format_id, title, plan=None):
+    """
+    ينفّذ تنزيل الفيديو داخل مهمة خلفية إلى مجلد مؤقت في المخزن، ثم ينشره ويعيد رابط الملف.
+    إذا لم يُعطَ plan (بيانات الفيديو لم تكن في الكاش عند الطلب) تُستخرج البيانات ويُخطط هنا.
+    """
+    if plan is None:
+        job.update_progress({"stage": "planning"})
+        try:
+            info = fetch_video_info(url)
+        except Exception as e:
+            app.logger.warning(f"Could not load formats for download planning: {e}")
+            info = None
+        plan = plan_download_format(info, format_id)
+    store_key = download_store_key(url, plan)
+
+    with storage_janitor.in_use(os.path.join(ARTIFACT_STORE_FOLDER, store_key)):
+        stored_path = artifact_store.lookup(store_key)
+        if stored_path is not None:
+            job.update_progress({"stage": "done", "percent": 100.0})
+            return {**publish_artifact(stored_path, title), "format_plan": plan}
+
+    specific_download_path = artifact_store.temp_dir(store_key)
+    storage_janitor.hold(specific_download_path)
+    try:
+        return _download_into_store(job, url, plan, title, store_key, specific_download_path)
+    finally:
+        storage_janitor.release(specific_download_path)
+
+
+def _download_into_store(job, url, plan, title, store_key, specific_download_path):
 
     safe_title = sanitize_filename(title)
     output_template = os.path.join(specific_download_path, f"{safe_title}.%(ext)s")
 
-    # دمج الصيغة المطلوبة مع أفضل صوت دائمًا
-    merged_format = f"{format_id}+bestaudio"
-    command = [
-        yt_dlp_path,
-        "-f", merged_format,
-        "--merge-output-format", "mp4",
+    # الصيغة والحاوية حسب plan_download_format (دون دمج إن كان الصوت ضمن الصيغة)
+    command = ["-f", plan["format"]]
+    if plan["merge_output_format"]:
+        command += ["--merge-output-format", plan["merge_output_format"]]
+    command += [
         "-o", output_template,
         "--no-warnings",
         "--no-playlist",
         url
     ]
+    job.update_progress({"format_plan": plan})
+
+    # نقيس زمن الدمج من بداية مرحلة merging حتى انتهاء yt-dlp
+    merge_started = []
+
+    def on_progress(progress):
+        if progress.get("stage") == "merging" and not merge_started:
+            merge_started.append(time.monotonic())
+        job.update_progress(progress)
 
     try:
-        subprocess.run(command, capture_output=True, text=True, check=True, timeout=300)
+        run_yt_dlp(command, timeout=300, on_progress=on_progress, cancel_event=job.cancel_event)
+    except JobCancelled:
+        shutil.rmtree(specific_download_path, ignore_errors=True)
+        raise
+    except subprocess.TimeoutExpired:
+        shutil.rmtree(specific_download_path, ignore_errors=True)
+        raise JobError("Download timed out. The video might be too large or the connection slow.")
+    except subprocess.CalledProcessError as e:
+        shutil.rmtree(specific_download_path, ignore_errors=True)
+        stderr = e.stderr or ""
+        error_message = f"yt-dlp download error: {stderr}"
+        if "HTTP Error 403" in stderr:
+            error_message = "Access denied (403). The video might be private or require login."
+        raise JobError(error_message)
 
-        downloaded_files = os.listdir(specific_download_path)
-        if not downloaded_files:
-            return jsonify({"error": "Download failed, no file found."}), 500
+    # نبحث عن الملف النهائي (بامتداد، وليس ملفات .part المؤقتة)
+    downloaded_files = [
+        f for f in os.listdir(specific_download_path)
+        if os.path.isfile(os.path.join(specific_download_path, f)) and "." in f and not f.endswith(".part")
+    ]
+    if not downloaded_files:
+        shutil.rmtree(specific_download_path, ignore_errors=True)
+        raise JobError("Download failed, no file found.")
+    # الملف المدموج بامتداد الحاوية المخطط لها إن وُجد، وإلا الأكبر (بقايا الصيغ المنفصلة أصغر منه)
+    planned = [f for f in downloaded_files if plan["merge_output_format"]
+               and f.endswith("." + plan["merge_output_format"])]
+    final = max(planned or downloaded_files,
+                key=lambda f: os.path.getsize(os.path.join(specific_download_path, f)))
+    for extra in downloaded_files:
+        if extra != final:
+            os.remove(os.path.join(specific_download_path, extra))
 
-        # نبحث أولًا عن ملف به امتداد
-        valid_files = [
-            f for f in downloaded_files
-            if os.path.isfile(os.path.join(specific_download_path, f)) and "." in f
-        ]
-        filename = valid_files[0] if valid_files else downloaded_files[0]
-        encoded_filename = urllib.parse.quote(filename, safe="")
+    merge_seconds = round(time.monotonic() - merge_started[0], 3) if merge_started else None
+    stored_path = artifact_store.commit(store_key, specific_download_path)
+    job.update_progress({"stage": "done", "percent": 100.0})
+    return {**publish_artifact(stored_path, title), "format_plan": plan, "merge_seconds": merge_seconds}
 
-        return jsonify({"download_url": f"/api/serve/{download_id}/{encoded_filename}"})
 
+@app.route("/api/stream-video")
+@admission("stream")
+def stream_video():
+    """
+    يبث صيغة فيها صوت (has_audio) من مخرجات yt-dlp (-o -) مباشرة إلى العميل كاستجابة chunked،
+    فيبدأ العميل بالاستلام فور وصول أول بايت ويبقى استهلاك الذاكرة ثابتًا مهما كان حجم الملف.
+    الصيغ التي تحتاج دمجًا مع الصوت تبقى عبر /api/download-video لأن ملف mp4 المدموج يحتاج قرصًا.
+    معاملات الرابط: url، format_id، title (اختياري)، cache=0 لتعطيل حفظ نسخة في المخزن.
+    """
+    url = request.args.get("url")
+    format_id = request.args.get("format_id")
+    title = request.args.get("title", "video")
+    tee = STREAM_TEE and request.args.get("cache", "1") != "0"
+
+    if not url or not format_id:
+        return jsonify({"error": "URL and format ID are required"}), 400
+
+    if not is_valid_url(url):
+        return jsonify({"error": "Invalid URL. Only YouTube and Twitter/X links are supported."}), 400
+
+    try:
+        info = fetch_video_info(url)
     except subprocess.TimeoutExpired:
-        return jsonify({"error": "Download timed out. The video might be too large or the connection slow."}), 504
+        return jsonify({"error": "Processing timed out. The video might be too long or the server is busy."}), 504
     except subprocess.CalledProcessError as e:
-        stderr = e.stderr or ""
+        return jsonify({"error": f"yt-dlp error: {e.stderr or ''}"}), 500
+
+    fmt = next((f for f in info["formats"] + info["audio_formats"] if f["format_id"] == format_id), None)
+    if fmt is None:
+        return jsonify({"error": "Unknown format ID."}), 400
+    if not fmt.get("has_audio", True):
+        return jsonify({"error": "This format has no audio track; use /api/download-video to merge it."}), 400
+
+    # إذا بُثّ نفس المحتوى سابقًا نحوّل إلى الملف المخزّن (مع دعم Range)
+    store_key = ArtifactStore.key(video_cache_key(url), format_id, {"stream": True})
+    with storage_janitor.in_use(os.path.join(ARTIFACT_STORE_FOLDER, store_key)):
+        stored_path = artifact_store.lookup(store_key)
+        if stored_path is not None:
+            return redirect(publish_artifact(stored_path, title)["download_url"])
+    forwarded = forward_to_artifact_owner(store_key)
+    if forwarded is not None:
+        return forwarded
+
+    started = time.monotonic()
+    command = [
+        get_yt_dlp_path(),
+        "-f", format_id,
+        "-o", "-",
+        "--quiet",
+        "--no-warnings",
+        "--no-playlist",
+        "--no-part",
+        "--socket-timeout", "30",
+        url
+    ]
+    stream = StreamProcess(command)
+
+    # ننتظر أول قطعة قبل إرسال الترويسات حتى نعيد خطأ JSON إن فشل yt-dlp من البداية
+    first_chunk = stream.read()
+    if not first_chunk:
+        stream.close()
+        stderr = b"".join(stream.stderr_tail).decode("utf-8", "replace")
         error_message = f"yt-dlp download error: {stderr}"
         if "HTTP Error 403" in stderr:
             error_message = "Access denied (403). The video might be private or require login."
-        return jsonify({"error": error_message}), 500
-    except Exception as e:
-        app.logger.error(f"Unexpected error in /api/download-video: {e}", exc_info=True)
-        return jsonify({"error": f"An unexpected error occurred during download: {str(e)}"}), 500
+        return jsonify({"error": error_message}), 502
+    ttfb_ms = (time.monotonic() - started) * 1000
+
+    ext = fmt.get("ext") or "mp4"
+    response = app.response_class(
+        relay_stream(stream, first_chunk, store_key if tee else None, ext),
+        mimetype=mimetypes.guess_type(f"video.{ext}")[0] or "application/octet-stream",
+    )
+    # المولّد لا يبدأ إن أُغلقت الاستجابة قبل إرسال الترويسات، فلا يصل إلى finally الخاص به
+    response.call_on_close(stream.close)
+    response.headers.set("Content-Disposition", "attachment", filename=f"{sanitize_filename(title)}.{ext}")
+    response.headers["Cache-Control"] = "no-store"
+    # حتى لا يخزّن nginx الاستجابة كاملة قبل تمريرها
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["Server-Timing"] = f"ttfb;dur={ttfb_ms:.1f}"
+    return response
+
+
+class StreamProcess:
+    """
+    عملية yt-dlp تكتب الملف إلى stdout للبث. close() تقتلها إن كانت ما زالت تعمل وتغلق أنبوبها
+    وتسجّلها في مقاييس subprocess، مرة واحدة مهما تكرر استدعاؤها.
+    """
+
+    def __init__(self, command):
+        self.started = time.monotonic()
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stderr_tail = deque(maxlen=50)
+        threading.Thread(target=lambda: self.stderr_tail.extend(self.proc.stderr), daemon=True).start()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def read(self):
+        return self.proc.stdout.read1(STREAM_CHUNK_SIZE)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        killed = self.proc.poll() is None
+        if killed:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc.stdout.close()
+        outcome = "cancelled" if killed else ("ok" if self.proc.returncode == 0 else "error")
+        record_subprocess("yt-dlp", "stream", time.monotonic() - self.started, outcome)
+
+
+def relay_stream(stream, first_chunk, store_key, ext):
+    """
+    مولّد يمرّر مخرجات yt-dlp قطعةً قطعة، ويكتب نسخة في مجلد مؤقت في المخزن إن أُعطي store_key
+    ثم يثبّتها عند اكتمال البث بنجاح. عند انقطاع العميل تُقتل العملية ويُحذف المجلد المؤقت.
+    """
+    tee_dir = tee_file = None
+    if store_key is not None:
+        tee_dir = artifact_store.temp_dir(store_key)
+        storage_janitor.hold(tee_dir)
+        tee_file = open(os.path.join(tee_dir, f"stream.{ext}"), "wb")
+    committed = False
+    try:
+        chunk = first_chunk
+        while chunk:
+            if tee_file is not None:
+                tee_file.write(chunk)
+            metrics.inc("served_bytes_total", len(chunk), route="stream")
+            yield chunk
+            chunk = stream.read()
+        # نهاية الأنبوب: ننتظر خروج العملية قبل close() حتى لا تُعدّ مقتولة
+        stream.proc.wait()
+        stream.close()
+        if stream.proc.returncode != 0:
+            app.logger.warning(f"yt-dlp stream exited with code {stream.proc.returncode}")
+        elif tee_file is not None:
+            tee_file.close()
+            artifact_store.commit(store_key, tee_dir)
+            committed = True
+    finally:
+        stream.close()
+        if tee_dir is not None:
+            tee_file.close()
+            if not committed:
+                shutil.rmtree(tee_dir, ignore_errors=True)
+            storage_janitor.release(tee_dir)
+
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        # مهمة تعمل على نسخة أخرى: حالتها منشورة في مخزن التنسيق
+        record = coordinator.job(job_id)
+        if record is None:
+            return jsonify({"error": "Job not found."}), 404
+        return jsonify(record)
+    if request.headers.get(METRICS_DEBUG_HEADER):
+        return jsonify({**job.to_dict(), "timings": job.timings})
+    return jsonify(job.to_dict())
+
+
+def forward_to_job_owner(job_id):
+    """يمرّر الطلب إلى النسخة التي تنفّذ المهمة. يعيد None إن لم تُعرف أو تعذر الوصول إليها."""
+    record = coordinator.job(job_id)
+    return coordinator.forward(record["node"]) if record else None
+
+
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    if jobs.get(job_id) is None:
+        forwarded = forward_to_job_owner(job_id)
+        if forwarded is not None:
+            return forwarded
+    try:
+        job = jobs.cancel(job_id, request.args.get("ticket"))
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    # requesters > 0: طلبات أخرى ما زالت تنتظر نفس المهمة فتستمر من أجلها
+    return jsonify({**job.to_dict(), "requesters": job.requesters})
 
 
 @app.route("/api/download-subtitle", methods=["POST"])
+@admission("subtitle")
+@storage_janitor.holding
 def download_subtitle():
     """
     يُنَزِّل ملف الترجمة الأصلي (يدوي أو آلي) للغة source_lang.
@@ -274,41 +3709,15 @@ def download_subtitle():
     if not url or not lang:
         return jsonify({"error": "URL and language code are required"}), 400
 
-    yt_dlp_path = get_yt_dlp_path()
-    download_id = str(uuid.uuid4())
+    download_id = coordinator.new_download_id()
     specific_download_path = os.path.join(app.config["DOWNLOAD_FOLDER"], download_id)
-    os.makedirs(specific_download_path, exist_ok=True)
-
-    safe_title = sanitize_filename(title)
-    output_template = os.path.join(specific_download_path, f"{safe_title}.{lang}.%(ext)s")
-
-    command = [
-        yt_dlp_path,
-        "--skip-download",
-        "--sub-langs", lang,
-        "--sub-format", "vtt",
-        "-o", output_template,
-        "--no-warnings",
-        "--no-playlist",
-        url
-    ]
-    if is_auto:
-        command.insert(1, "--write-auto-subs")
-    else:
-        command.insert(1, "--write-subs")
+    storage_janitor.new_folder(specific_download_path)
 
     try:
-        subprocess.run(command, capture_output=True, text=True, check=True, timeout=120)
-
-        downloaded_files = os.listdir(specific_download_path)
-        vtt_files = [
-            f for f in downloaded_files
-            if os.path.isfile(os.path.join(specific_download_path, f)) and f.endswith(".vtt")
-        ]
-        if not vtt_files:
+        filename = fetch_subtitle_file(url, lang, is_auto, specific_download_path, sanitize_filename(title))
+        if filename is None:
             return jsonify({"error": "No VTT file found after download."}), 500
 
-        filename = vtt_files[0]
         encoded_filename = urllib.parse.quote(filename, safe="")
 
         return jsonify({"download_url": f"/api/serve/{download_id}/{encoded_filename}"})
@@ -324,6 +3733,8 @@ def download_subtitle():
 
 
 @app.route("/api/translate-subtitle", methods=["POST"])
+@admission("subtitle")
+@storage_janitor.holding
 def translate_subtitle():
     """
     ينشئ ترجمة جديدة (مثلاً إلى العربية) لملف VTT الأصلي/الآلي.
@@ -346,52 +3757,30 @@ def translate_subtitle():
     if not url or not source_lang or not target_lang:
         return jsonify({"error": "URL, source_lang, and target_lang are required"}), 400
 
-    yt_dlp_path = get_yt_dlp_path()
-    download_id = str(uuid.uuid4())
+    download_id = coordinator.new_download_id()
     specific_download_path = os.path.join(app.config["DOWNLOAD_FOLDER"], download_id)
-    os.makedirs(specific_download_path, exist_ok=True)
+    storage_janitor.new_folder(specific_download_path)
 
     safe_title = sanitize_filename(title)
-    orig_output_template = os.path.join(
-        specific_download_path, f"{safe_title}.{source_lang}.%(ext)s"
-    )
-
-    command = [
-        yt_dlp_path,
-        "--skip-download",
-        "--sub-langs", source_lang,
-        "--sub-format", "vtt",
-        "-o", orig_output_template,
-        "--no-warnings",
-        "--no-playlist",
-        url
-    ]
-    if is_auto:
-        command.insert(1, "--write-auto-subs")
-    else:
-        command.insert(1, "--write-subs")
 
     try:
         # نحمّل ملف الترجمة الأصلي أولًا
-        subprocess.run(command, capture_output=True, text=True, check=True, timeout=120)
-
-        downloaded_files = os.listdir(specific_download_path)
-        vtt_files = [
-            f for f in downloaded_files
-            if os.path.isfile(os.path.join(specific_download_path, f)) and f.endswith(".vtt")
-        ]
-        if not vtt_files:
+        orig_vtt_filename = fetch_subtitle_file(url, source_lang, is_auto, specific_download_path, safe_title)
+        if orig_vtt_filename is None:
             return jsonify({"error": "No VTT file found after download."}), 500
 
-        orig_vtt_filename = vtt_files[0]
         orig_vtt_path = os.path.join(specific_download_path, orig_vtt_filename)
 
         # نقرأ محتوى الـ VTT
         with open(orig_vtt_path, "r", encoding="utf-8") as f:
             vtt_content = f.read()
 
-        # نترجم المحتوى إلى اللغة target_lang
-        translated_vtt_content = parse_vtt_and_translate(vtt_content, target_lang)
+        # نترجم المحتوى إلى اللغة target_lang؛ الكتل التي لم تتغير منذ آخر ترجمة لنفس المسار تُعاد كما هي
+        track_key = "|".join((video_cache_key(url), normalize_lang(source_lang), target_lang,
+                              "auto" if is_auto else "manual"))
+        translated_vtt_content, cue_stats = translate_vtt_incremental(
+            vtt_content, target_lang, source_lang, track_key
+        )
 
         # نكتب الملف المترجم باسم جديد
         translated_filename = f"{safe_title}.{source_lang}_to_{target_lang}.vtt"
@@ -400,7 +3789,7 @@ def translate_subtitle():
             f.write(translated_vtt_content)
 
         encoded_filename = urllib.parse.quote(translated_filename, safe="")
-        return jsonify({"download_url": f"/api/serve/{download_id}/{encoded_filename}"})
+        return jsonify({"download_url": f"/api/serve/{download_id}/{encoded_filename}", **cue_stats})
 
     except subprocess.TimeoutExpired:
         return jsonify({"error": "Subtitle translation timed out."}), 504
@@ -412,7 +3801,13 @@ def translate_subtitle():
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+def _generate_translation_workload():
+    # الوضع غير المتزامن يعيد رقم مهمة فورًا (ويحدّه طابور المهام)، أما المتزامن فيشغل Whisper داخل الطلب
+    return "light" if (request.get_json(silent=True) or {}).get("async") else "heavy"
+
+
 @app.route("/api/generate-translation", methods=["POST"])
+@admission(_generate_translation_workload)
 def generate_translation():
     """
     مسار جديد لتوليد ترجمة عربية (أو لغة أخرى) لفيديو تويتر أو يوتيوب.
@@ -425,98 +3820,158 @@ def generate_translation():
       {
         "url": "<video_url>",
         "target_lang": "<desired_translation_language_code>",
-        "title": "<video_title>"
+        "title": "<video_title>",
+        "model_size": "<tiny|base|small>",   (اختياري)
+        "async": <true_or_false>              (اختياري: يعيد رقم مهمة فورًا)
       }
+    في الوضع غير المتزامن تُقرأ المقاطع المفرّغة حتى الآن من /api/jobs/<job_id>/partial.
     """
     data = request.get_json()
     url = data.get("url")
     target_lang = data.get("target_lang", "ar")
     title = data.get("title", "whisper_subtitle")
+    model_size = data.get("model_size", WHISPER_DEFAULT_MODEL)
 
     if not url or not target_lang:
         return jsonify({"error": "URL and target_lang are required"}), 400
 
-    yt_dlp_path = get_yt_dlp_path()
-    download_id = str(uuid.uuid4())
+    if model_size not in whisper_models.allowed:
+        return jsonify({"error": f"Unsupported model_size. Allowed: {', '.join(whisper_models.allowed)}"}), 400
+
+    if data.get("async"):
+        job, ticket = jobs.submit("generate-translation", run_generate_translation, url, target_lang, title, model_size)
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}",
+            **job_ticket_fields(job, ticket),
+        }), 202
+
+    try:
+        return jsonify(run_generate_translation(Job("generate-translation"), url, target_lang, title, model_size))
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+
+@storage_janitor.holding
+def run_generate_translation(job, url, target_lang, title, model_size):
+    """
+    ينفّذ خطوات generate_translation ويعيد رابط الملف المترجم، أو يرمي JobError.
+    """
+    download_id = coordinator.new_download_id()
     specific_download_path = os.path.join(app.config["DOWNLOAD_FOLDER"], download_id)
-    os.makedirs(specific_download_path, exist_ok=True)
+    storage_janitor.new_folder(specific_download_path)
 
     safe_title = sanitize_filename(title)
     audio_output = os.path.join(specific_download_path, f"{safe_title}.m4a")
 
-    # 1. تحميل مسار الصوت فقط (bestaudio)
-    download_audio_cmd = [
-        yt_dlp_path,
-        "-f", "bestaudio",
-        "-o", audio_output,
-        "--no-warnings",
-        "--no-playlist",
-        url
-    ]
+    # إذا فُرّغ نفس الفيديو بنفس النموذج سابقًا نتخطى تنزيل الصوت والتفريغ
+    video_key = video_cache_key(url)
+    result = transcript_cache.get_by_video(video_key, model_size)
 
-    try:
-        subprocess.run(download_audio_cmd, capture_output=True, text=True, check=True, timeout=300)
-    except subprocess.TimeoutExpired:
-        return jsonify({"error": "Audio download timed out."}), 504
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr or ""
-        return jsonify({"error": f"yt-dlp audio error: {stderr}"}), 500
-    except Exception as e:
-        app.logger.error(f"Error downloading audio: {e}", exc_info=True)
-        return jsonify({"error": f"Unexpected error during audio download: {e}"}), 500
+    pcm = None
+    if result is None and TRANSCRIBE_AUDIO_FAST_PATH:
+        # 1أ. المسار السريع: أصغر صيغة صوتية كافية تُفك مباشرة إلى PCM دون ملف وسيط
+        job.update_progress({"stage": "downloading"})
+        try:
+            streamed = stream_transcription_audio(url, cancel_event=job.cancel_event)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            app.logger.warning(f"Audio fast path failed, falling back to bestaudio download: {e}")
+            streamed = None
+        if streamed is not None:
+            pcm, audio_stats = streamed
+            job.update_progress({"audio": audio_stats})
+            audio_sha256 = audio_stats["audio_sha256"]
+            result = transcript_cache.get_by_audio(audio_sha256, model_size)
+            if result is not None:
+                transcript_cache.link_video(video_key, audio_sha256, model_size)
+
+    if result is None and pcm is None:
+        # 1. تحميل مسار الصوت فقط (bestaudio)
+        download_audio_cmd = [
+            "-f", "bestaudio",
+            "-o", audio_output,
+            "--no-warnings",
+            "--no-playlist",
+            url
+        ]
 
-    # 2. تحميل نموذج Whisper بشكل lazy (أول طلب)
-    global whisper_model
-    if whisper_model is None:
+        job.update_progress({"stage": "downloading"})
         try:
-            whisper_model = whisper.load_model("tiny")
-            # إذا أردت دقّة أعلى على حساب استهلاك أكثر، يمكنك استخدام "base" أو "small"
-            # لكن تأكد من حدود الذاكرة في Render إذا اخترت "small"
+            run_yt_dlp(download_audio_cmd, timeout=300, cancel_event=job.cancel_event, operation="audio")
+        except JobCancelled:
+            shutil.rmtree(specific_download_path, ignore_errors=True)
+            raise
+        except subprocess.TimeoutExpired:
+            raise JobError("Audio download timed out.", 504)
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr or ""
+            raise JobError(f"yt-dlp audio error: {stderr}")
         except Exception as e:
-            app.logger.error(f"Failed to load Whisper model: {e}", exc_info=True)
-            return jsonify({"error": f"Could not load transcription model: {e}"}), 500
+            app.logger.error(f"Error downloading audio: {e}", exc_info=True)
+            raise JobError(f"Unexpected error during audio download: {e}")
 
-    # 3. استخدم النموذج للتفريغ الزمني
-    try:
-        result = whisper_model.transcribe(audio_output, verbose=False, word_timestamps=False)
-
-        # بناء محتوى WebVTT يدويًا
-        vtt_lines = ["WEBVTT\n"]
-        for i, segment in enumerate(result["segments"], start=1):
-            start = segment["start"]
-            end = segment["end"]
-            text = segment["text"].strip()
-
-            def format_timestamp(sec: float):
-                hours = int(sec // 3600)
-                minutes = int((sec % 3600) // 60)
-                seconds = sec % 60
-                return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
-
-            vtt_lines.append(str(i))
-            vtt_lines.append(f"{format_timestamp(start)} --> {format_timestamp(end)}")
-            vtt_lines.append(text)
-            vtt_lines.append("")  # سطر فارغ بين الكتل
+        # نفس الصوت من رابط مختلف يُعاد استخدام تفريغه أيضًا
+        audio_sha256 = file_sha256(audio_output)
+        result = transcript_cache.get_by_audio(audio_sha256, model_size)
+        if result is not None:
+            transcript_cache.link_video(video_key, audio_sha256, model_size)
 
+    if result is None:
+        if pcm is None:
+            job.update_progress({"stage": "decoding"})
+            try:
+                with track_subprocess("ffmpeg", "decode"):
+                    pcm = decode_audio_pcm(audio_output)
+            except Exception as e:
+                app.logger.error(f"Error decoding audio: {e}", exc_info=True)
+                raise JobError(f"Whisper transcription failed: {e}")
+
+        # 2. تحميل نموذج Whisper (أو استخدامه مباشرة إن كان محمّلًا مسبقًا)؛ مسار القطع المتوازية
+        # لا يحتاجه لأن كل عملية عامل تحمّل نسختها
+        if chunked_parallelism(pcm, model_size) < 2:
+            job.update_progress({"stage": "loading_model"})
+            try:
+                whisper_models.get(model_size)
+            except Exception as e:
+                app.logger.error(f"Failed to load Whisper model: {e}", exc_info=True)
+                raise JobError(f"Could not load transcription model: {e}")
+
+        # 3. التفريغ الزمني (على قطع متوازية للصوت الطويل)
+        job.update_progress({"stage": "transcribing"})
+        try:
+            result = transcribe_pcm(job, pcm, model_size)
+            result = transcript_cache.put(video_key, audio_sha256, model_size, result)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            app.logger.error(f"Error running whisper transcription: {e}", exc_info=True)
+            raise JobError(f"Whisper transcription failed: {e}")
+
+    job.update_progress({"stage": "writing"})
+    try:
         orig_vtt_filename = f"{safe_title}.orig.vtt"
         orig_vtt_path = os.path.join(specific_download_path, orig_vtt_filename)
         with open(orig_vtt_path, "w", encoding="utf-8") as f:
-            f.write("\n".join(vtt_lines))
-
+            f.write(segments_to_vtt(result["segments"]))
     except Exception as e:
-        app.logger.error(f"Error running whisper transcription: {e}", exc_info=True)
-        return jsonify({"error": f"Whisper transcription failed: {e}"}), 500
+        app.logger.error(f"Error writing original VTT: {e}", exc_info=True)
+        raise JobError(f"Failed to save original VTT: {e}")
 
     # 4. قراءة الـ VTT الأصلي ثم ترجمته
+    job.update_progress({"stage": "translating"})
     try:
         with open(orig_vtt_path, "r", encoding="utf-8") as f:
             vtt_content = f.read()
-        translated_vtt_content = parse_vtt_and_translate(vtt_content, target_lang)
+        translated_vtt_content = parse_vtt_and_translate(vtt_content, target_lang, result.get("language"))
     except Exception as e:
         app.logger.error(f"Error reading/translating VTT: {e}", exc_info=True)
-        return jsonify({"error": f"Failed to translate VTT: {e}"}), 500
+        raise JobError(f"Failed to translate VTT: {e}")
 
     # 5. كتابة الملف المترجم باسم جديد
+    job.update_progress({"stage": "writing"})
     translated_filename = f"{safe_title}_to_{target_lang}.vtt"
     translated_filepath = os.path.join(specific_download_path, translated_filename)
     try:
@@ -524,21 +3979,189 @@ def generate_translation():
             f.write(translated_vtt_content)
     except Exception as e:
         app.logger.error(f"Error writing translated VTT: {e}", exc_info=True)
-        return jsonify({"error": f"Failed to save translated VTT: {e}"}), 500
+        raise JobError(f"Failed to save translated VTT: {e}")
 
+    job.update_progress({"stage": "done", "percent": 100.0})
     encoded_filename = urllib.parse.quote(translated_filename, safe="")
-    return jsonify({"download_url": f"/api/serve/{download_id}/{encoded_filename}"})
+    return {"download_url": f"/api/serve/{download_id}/{encoded_filename}"}
+
+
+@app.route("/api/jobs/<job_id>/partial")
+def get_job_partial(job_id):
+    """
+    يعيد المقاطع المفرّغة حتى الآن لمهمة generate-translation كملف VTT.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        forwarded = forward_to_job_owner(job_id)
+        if forwarded is not None:
+            return forwarded
+        return jsonify({"error": "Job not found."}), 404
+    partial = job.partial or {"segments": [], "chunks_done": 0, "chunks_total": 0}
+    response = app.response_class(segments_to_vtt(partial["segments"]), mimetype="text/vtt")
+    response.headers["X-Chunks-Done"] = str(partial["chunks_done"])
+    response.headers["X-Chunks-Total"] = str(partial["chunks_total"])
+    return response
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.monotonic()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    seconds = time.monotonic() - g.get("request_started", time.monotonic())
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.observe("http_request_duration_seconds", seconds,
+                    endpoint=endpoint, method=request.method, status=response.status_code)
+    if request.endpoint == "serve_file" and response.status_code in (200, 206):
+        metrics.inc("served_bytes_total", response.content_length or 0, route="serve")
+
+    # أزمنة المراحل للتشخيص، فقط عند إرسال ترويسة METRICS_DEBUG_HEADER
+    if request.headers.get(METRICS_DEBUG_HEADER):
+        timings = [f"{stage};dur={value * 1000:.1f}" for stage, value in g.get("stage_timings", [])]
+        timings.append(f"total;dur={seconds * 1000:.1f}")
+        if response.headers.get("Server-Timing"):
+            timings.insert(0, response.headers["Server-Timing"])
+        response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+
+
+def _collect_gauges():
+    gauges = []
+    for (kind, status), count in jobs.in_flight().items():
+        gauges.append(("jobs_in_flight", {"kind": kind, "status": status}, count))
+    for workload, stats in admission_controller.stats().items():
+        gauges.append(("admission_running", {"workload": workload}, stats["running"]))
+        gauges.append(("admission_queued", {"workload": workload}, stats["queued"]))
+    for name, stats in (
+        ("metadata", metadata_cache.stats()),
+        ("translation_memory", translation_memory.stats()),
+        ("transcripts", transcript_cache.stats()),
+    ):
+        gauges.append(("cache_hit_ratio", {"cache": name}, stats["hit_ratio"]))
+        gauges.append(("cache_entries", {"cache": name}, stats["entries"]))
+    artifacts = artifact_store.stats()
+    gauges.append(("cache_entries", {"cache": "artifacts"}, artifacts["entries"]))
+    gauges.append(("artifact_hits_total", {}, artifacts["hits"]))
+    gauges.append(("artifact_bytes", {}, artifacts["bytes"]))
+    storage = storage_janitor.stats()
+    gauges.append(("download_folder_bytes", {}, storage["usage_bytes"]))
+    gauges.append(("download_folder_reclaimed_bytes", {}, storage["bytes_reclaimed"]))
+    gauges.append(("disk_free_bytes", {}, shutil.disk_usage(DOWNLOAD_FOLDER).free))
+    models = whisper_models.stats()
+    gauges.append(("whisper_models_loaded", {}, len(models["loaded"])))
+    gauges.append(("whisper_models_memory_mb", {}, models["memory_mb"]))
+    return gauges
+
+
+metrics.add_collector(_collect_gauges)
+metrics.describe("jobs_in_flight", "gauge", "Queued or running background jobs.")
+metrics.describe("admission_running", "gauge", "Requests holding an admission slot per workload class.")
+metrics.describe("admission_queued", "gauge", "Requests waiting for admission per workload class.")
+metrics.describe("cache_hit_ratio", "gauge", "Hit ratio per cache since start.")
+metrics.describe("cache_entries", "gauge", "Entries per cache.")
+metrics.describe("artifact_hits_total", "counter", "Downloads answered from the artifact store.")
+metrics.describe("artifact_bytes", "gauge", "Bytes held in the artifact store.")
+metrics.describe("download_folder_bytes", "gauge", "DOWNLOAD_FOLDER usage measured by the last janitor run.")
+metrics.describe("download_folder_reclaimed_bytes", "gauge", "Bytes freed by the janitor since start.")
+metrics.describe("disk_free_bytes", "gauge", "Free space on the DOWNLOAD_FOLDER filesystem.")
+metrics.describe("whisper_models_loaded", "gauge", "Whisper models held in memory.")
+metrics.describe("whisper_models_memory_mb", "gauge", "Approximate memory of loaded Whisper models.")
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/cache/stats")
+def cache_stats():
+    return jsonify({
+        "metadata": metadata_cache.stats(),
+        "translation_memory": {**translation_memory.stats(), "cue_versions": cue_translation_store.stats()},
+        "whisper_models": whisper_models.stats(),
+        "transcripts": transcript_cache.stats(),
+        "artifacts": {**artifact_store.stats(), "attached_requests": jobs.attached},
+        "storage": storage_janitor.stats(),
+        "direct_fetch": direct_fetcher.stats(),
+        "coordination": coordinator.stats(),
+        "admission": {**admission_controller.stats(), "jobs": {
+            "queued": sum(n for (_, status), n in jobs.in_flight().items() if status == "queued"),
+            "queue_max": jobs.max_queued,
+        }},
+    })
+
+
+def _accel_redirect_response(download_id, filename):
+    """
+    استجابة فارغة بترويسة X-Accel-Redirect؛ nginx يرسل الملف ويتولى Range وETag بنفسه.
+    """
+    response = app.response_class(status=200)
+    response.headers["X-Accel-Redirect"] = SERVE_ACCEL_PREFIX + urllib.parse.quote(f"{download_id}/{filename}")
+    response.headers.set("Content-Disposition", "attachment", filename=os.path.basename(filename))
+    response.content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return response
+
+
+def _use_file_wrapper_for_range(response, path):
+    """
+    Werkzeug يلفّ استجابات 206 بـ _RangeWrapper فتمر البايتات عبر Python. تحت gunicorn نعطي
+    wsgi.file_wrapper ملفًا مُزاحًا إلى بداية المدى، فيرسله عبر sendfile ويتوقف عند Content-Length.
+    (نقتصر على gunicorn لأن خوادم أخرى قد ترسل الملف حتى نهايته متجاهلة Content-Length.)
+    """
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if (response.status_code != 206 or file_wrapper is None or response.content_range is None
+            or not request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn")):
+        return response
+    f = open(path, "rb")
+    f.seek(response.content_range.start)
+    response.close()
+    response.response = file_wrapper(f, 1024 * 1024)
+    response.direct_passthrough = True
+    return response
 
 
 @app.route("/api/serve/<download_id>/<path:filename>")
 def serve_file(download_id, filename):
+    """
+    يخدم الملفات الناتجة مع دعم كامل لـ Range/If-Range وETag/Last-Modified
+    (استئناف التنزيل والتنقل داخل الفيديو دون إعادة التنزيل من البداية).
+    """
+    # المجلدات التي تبدأ بنقطة (مثل .cache) داخلية ولا تُخدَم
+    if download_id.startswith("."):
+        return jsonify({"error": "File not found."}), 404
+
     directory = os.path.join(app.config["DOWNLOAD_FOLDER"], download_id)
+    owner = coordinator.download_owner(download_id)
+    if owner and owner != coordinator.node_id and not os.path.isdir(directory):
+        # المجلد أنشأته نسخة أخرى خلف موزّع الحمل؛ نمرّر الطلب إليها (مع Range وETag)
+        forwarded = coordinator.forward(owner)
+        if forwarded is not None:
+            return forwarded
     try:
         safe_path = os.path.abspath(os.path.join(directory, filename))
         if not safe_path.startswith(os.path.abspath(directory)):
             return jsonify({"error": "Invalid path"}), 400
 
-        return send_from_directory(directory, filename, as_attachment=True)
+        if SERVE_MODE == "x-accel":
+            if not os.path.isfile(safe_path):
+                raise FileNotFoundError(safe_path)
+            storage_janitor.touch(directory)
+            return _accel_redirect_response(download_id, filename)
+
+        response = send_from_directory(
+            directory, filename, as_attachment=True, conditional=True, etag=True, max_age=SERVE_MAX_AGE
+        )
+        # محتوى كل مجلد تنزيل لا يتغير بعد إنشائه
+        response.cache_control.immutable = True
+        response = _use_file_wrapper_for_range(response, safe_path)
+
+        # نسجّل آخر استخدام للمجلد لترتيب الحذف. لا حاجة لحجزه: الملف مفتوح بالفعل، والواصف
+        # المفتوح يبقى صالحًا حتى لو حذف المنظّف الملف أثناء الإرسال
+        storage_janitor.touch(directory)
+        return response
     except FileNotFoundError:
         return jsonify({"error": "File not found."}), 404
     except Exception as e:
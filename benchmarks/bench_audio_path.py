@@ -0,0 +1,106 @@
+"""
+مقارنة مسار صوت التفريغ الحالي (تنزيل bestaudio إلى ملف ثم فك ترميزه) بالمسار السريع
+(أصغر صيغة صوتية كافية تُمرَّر من yt-dlp إلى ffmpeg مباشرة كـ PCM بتردد 16 kHz).
+يقيس البايتات المنقولة، والكتابة على القرص، والزمن الكلي، على خادم HTTP محلي.
+
+ملفات الصوت تُولَّد بـ ffmpeg (نغمة بطول --seconds) ما لم تُمرَّر ملفات حقيقية:
+    python benchmarks/bench_audio_path.py --seconds 600
+    python benchmarks/bench_audio_path.py --best recorded.m4a --small recorded.webm
+
+ملاحظة: إذا كان /tmp على tmpfs فعدّاد الكتابة على القرص للعمليات الفرعية يبقى صفرًا،
+لذلك نعرض أيضًا حجم الملف الوسيط المكتوب.
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WHISPER_PRELOAD", "")  # لا حاجة لنماذج Whisper في هذا القياس
+os.environ["YTDLP_ENGINE"] = "subprocess"
+
+import app  # noqa: E402
+from transcription import decode_audio_pcm, stream_audio_pcm  # noqa: E402
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_fixtures(root, seconds):
+    tone = ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}"]
+    best = os.path.join(root, "best.m4a")
+    small = os.path.join(root, "small.webm")
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y", *tone, "-ac", "2", "-ar", "48000",
+                    "-c:a", "aac", "-b:a", "160k", best], check=True)
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y", *tone, "-c:a", "libopus", "-b:a", "48k", small],
+                   check=True)
+    return best, small
+
+
+def disk_written():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_oublock * 512
+
+
+def current_path(url):
+    out_dir = tempfile.mkdtemp(prefix="bench_audio_file_")
+    start, written = time.perf_counter(), disk_written()
+    app.run_yt_dlp(["-o", os.path.join(out_dir, "audio.%(ext)s"), "--no-warnings", url], timeout=600)
+    audio_file = os.path.join(out_dir, os.listdir(out_dir)[0])
+    pcm = decode_audio_pcm(audio_file)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(audio_file)
+    shutil.rmtree(out_dir)
+    return {"bytes_transferred": size, "file_bytes_written": size,
+            "disk_bytes_written": disk_written() - written, "seconds": elapsed, "samples": len(pcm)}
+
+
+def fast_path(url):
+    start, written = time.perf_counter(), disk_written()
+    command = [app.get_yt_dlp_path(), "-o", "-", "--quiet", "--no-warnings", url]
+    pcm, stats = stream_audio_pcm(command, timeout=600)
+    elapsed = time.perf_counter() - start
+    return {"bytes_transferred": stats["bytes_transferred"], "file_bytes_written": 0,
+            "disk_bytes_written": disk_written() - written, "seconds": elapsed, "samples": len(pcm)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=int, default=300, help="length of generated fixtures")
+    parser.add_argument("--best", help="existing bestaudio file (e.g. m4a)")
+    parser.add_argument("--small", help="existing small audio file (e.g. low-bitrate opus)")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_audio_")
+    if args.best and args.small:
+        best, small = shutil.copy(args.best, root), shutil.copy(args.small, root)
+    else:
+        best, small = make_fixtures(root, args.seconds)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    rows = [
+        ("bestaudio file", current_path(base + os.path.basename(best))),
+        ("fast path pipe", fast_path(base + os.path.basename(small))),
+    ]
+    print(f"{'path':<16}{'transferred':>14}{'file written':>14}{'disk written':>14}{'latency':>10}{'audio':>9}")
+    for name, r in rows:
+        print(f"{name:<16}{r['bytes_transferred']:>14,}{r['file_bytes_written']:>14,}"
+              f"{r['disk_bytes_written']:>14,}{r['seconds']:>9.2f}s{r['samples'] / app.SAMPLE_RATE:>8.1f}s")
+    server.shutdown()
+    shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+قياس أداء كل نقاط النهاية دون إنترنت: yt-dlp يُستبدل بـ benchmarks/stubs/yt-dlp، ومترجم Google
+بمترجم وهمي، ونماذج Whisper بنموذج وهمي، وكلها بتأخير وحجم قابلين للضبط. التطبيق يعمل على خادم
+werkzeug متعدد الخيوط، وكل سيناريو يُرسل طلباته بعدد عملاء متزامنين ثابت.
+
+النتيجة JSON (زمن p50/p95/p99، الإنتاجية، ذروة RSS، البايتات المكتوبة على القرص لكل سيناريو)
+تُطبع على stdout أو تُحفظ بـ --output، ويمكن مقارنتها بنتيجة سابقة عبر --compare
+(رمز الخروج 1 إذا تجاوز p95 لأي سيناريو --threshold ضعف القيمة السابقة).
+يحتاج ffmpeg في PATH لسيناريو generate_translation.
+
+الاستخدام:
+    python benchmarks/bench_offline.py --requests 40 --concurrency 8 --output bench.json
+    python benchmarks/bench_offline.py --scenarios video_info,download_video --compare bench.json
+"""
+import argparse
+import http.server
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_YT_DLP = os.path.join(ROOT, "benchmarks", "stubs", "yt-dlp")
+sys.path.insert(0, ROOT)
+
+SCENARIOS = (
+    "video_info", "batch_video_info", "thumbnail", "download_subtitle", "translate_subtitle",
+    "download_video", "stream_video", "generate_translation", "metrics",
+)
+
+
+# --- البدائل المحلية --- #
+
+class FakeWhisperModel:
+    """نموذج Whisper وهمي: زمن التفريغ = مدة الصوت × rtf، ومقطع لكل ثانيتين."""
+
+    def __init__(self, rtf):
+        self.rtf = rtf
+
+    def transcribe(self, audio, **kwargs):
+        seconds = len(audio) / 16000
+        time.sleep(seconds * self.rtf)
+        segments = [
+            {"start": float(t), "end": float(min(t + 2, seconds)), "text": f" segment at {t} seconds"}
+            for t in range(0, int(seconds), 2)
+        ]
+        return {"language": "en", "segments": segments}
+
+
+def load_fake_model(size):
+    """دالة التحميل التي يستدعيها التطبيق عبر WHISPER_MODEL_LOADER."""
+    return FakeWhisperModel(float(os.environ.get("BENCH_WHISPER_RTF", 0.05)))
+
+
+class _StaticHandler(http.server.BaseHTTPRequestHandler):
+    """خادم محلي لروابط الترجمات والصور المصغّرة التي يضعها yt-dlp الوهمي في البيانات."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/subs/"):
+            vid = self.path.rsplit("/", 1)[1].split(".")[0]
+            lines = ["WEBVTT", ""]
+            for i in range(40):
+                lines += [f"00:00:{i:02d}.000 --> 00:00:{i + 1:02d}.000", f"line {i} of video {vid}", ""]
+            body, content_type = "\n".join(lines).encode("utf-8"), "text/vtt"
+        else:
+            body, content_type = b"\xff\xd8\xff" + b"\0" * 20000, "image/jpeg"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http(handler_or_app):
+    if isinstance(handler_or_app, type):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler_or_app)
+    else:
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, handler_or_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+# --- السيناريوهات --- #
+
+def video_url(tag, i):
+    return f"https://www.youtube.com/watch?v={tag}{i:09d}"
+
+
+def wait_job(session, base, response):
+    job = response.json()
+    job_id = job["job_id"]
+    while job["status"] not in ("finished", "failed", "cancelled"):
+        time.sleep(0.02)
+        job = session.get(f"{base}/api/jobs/{job_id}").json()
+    if job["status"] != "finished":
+        raise RuntimeError(f"job {job['status']}: {job.get('error')}")
+    return job["result"]
+
+
+def fetch(session, base, path):
+    """يحمّل الملف كاملًا على دفعات ويعيد عدد البايتات."""
+    with session.get(base + path, stream=True) as r:
+        r.raise_for_status()
+        return sum(len(chunk) for chunk in r.iter_content(256 * 1024))
+
+
+def scenario(name, session, base, i):
+    def post(path, body):
+        r = session.post(base + path, json=body)
+        r.raise_for_status()
+        return r
+
+    if name == "video_info":
+        post("/api/video-info", {"url": video_url("vi", i)})
+    elif name == "batch_video_info":
+        r = session.post(base + "/api/batch/video-info",
+                         json={"playlist_url": f"https://www.youtube.com/playlist?list=PL{i}"}, stream=True)
+        lines = [json.loads(line) for line in r.iter_lines() if line]
+        if any("error" in line for line in lines):
+            raise RuntimeError("batch item failed")
+    elif name == "thumbnail":
+        url = video_url("th", i)
+        post("/api/video-info", {"url": url})
+        r = session.get(base + "/api/thumbnail", params={"url": url})
+        r.raise_for_status()
+    elif name == "download_subtitle":
+        url = video_url("ds", i)
+        post("/api/video-info", {"url": url})
+        fetch(session, base, post("/api/download-subtitle", {"url": url, "lang": "en"}).json()["download_url"])
+    elif name == "translate_subtitle":
+        url = video_url("ts", i)
+        post("/api/video-info", {"url": url})
+        body = {"url": url, "source_lang": "en", "target_lang": "ar"}
+        fetch(session, base, post("/api/translate-subtitle", body).json()["download_url"])
+    elif name == "download_video":
+        result = wait_job(session, base, post("/api/download-video", {"url": video_url("dv", i), "format_id": "200"}))
+        fetch(session, base, result["download_url"])
+    elif name == "stream_video":
+        fetch(session, base, f"/api/stream-video?url={video_url('sv', i)}&format_id=18")
+    elif name == "generate_translation":
+        post("/api/generate-translation", {"url": video_url("gt", i), "target_lang": "ar"})
+    elif name == "metrics":
+        session.get(base + "/metrics").raise_for_status()
+
+
+# --- القياس --- #
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def folder_bytes(path):
+    inodes = {}
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                st = os.lstat(os.path.join(root, f))
+            except OSError:
+                continue
+            inodes[(st.st_dev, st.st_ino)] = st.st_size
+    return sum(inodes.values())
+
+
+def peak_rss_mb():
+    # ru_maxrss بالكيلوبايت على Linux؛ نضيف العمليات الفرعية (yt-dlp الوهمي، ffmpeg)
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(self_kb / 1024, 1), round(children_kb / 1024, 1)
+
+
+def run_scenario(name, base, download_folder, requests_count, concurrency):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    latencies, errors = [], []
+    disk_before = folder_bytes(download_folder)
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            scenario(name, session, base, i)
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    rss_self, rss_children = peak_rss_mb()
+    return {
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+        "peak_rss_mb": rss_self,
+        "peak_child_rss_mb": rss_children,
+        "disk_bytes_written": folder_bytes(download_folder) - disk_before,
+    }
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["scenarios"]
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before or not before.get("p95_ms") or current.get("p95_ms") is None:
+            continue
+        ratio = current["p95_ms"] / before["p95_ms"]
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"{name:<22} p95 {before['p95_ms']:>9.1f} -> {current['p95_ms']:>9.1f} ms  x{ratio:5.2f} {flag}",
+              file=sys.stderr)
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=40, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--ytdlp-latency", type=float, default=0.05, help="seconds per stub yt-dlp run")
+    parser.add_argument("--payload-mb", type=float, default=5, help="size of each stub video")
+    parser.add_argument("--audio-seconds", type=float, default=20, help="length of each stub audio track")
+    parser.add_argument("--formats", type=int, default=20, help="video formats in each stub --dump-json")
+    parser.add_argument("--translate-latency", type=float, default=0.02, help="seconds per translator call")
+    parser.add_argument("--whisper-rtf", type=float, default=0.05, help="fake transcription time / audio time")
+    parser.add_argument("--output", help="write JSON results to this file as well as stdout")
+    parser.add_argument("--compare", help="previous JSON results to compare p95 latency against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="p95 ratio counted as a regression")
+    args = parser.parse_args()
+
+    names = [n for n in args.scenarios.split(",") if n]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    static_base, _ = start_http(_StaticHandler)
+    download_folder = tempfile.mkdtemp(prefix="bench_offline_")
+    # قبل استيراد app: مجلد تنزيل مؤقت، yt-dlp الوهمي، ودون تحميل مسبق لنماذج Whisper
+    os.environ.update({
+        "DOWNLOAD_FOLDER": download_folder,
+        "YT_DLP_PATH": STUB_YT_DLP,
+        "YTDLP_ENGINE": "subprocess",
+        "WHISPER_PRELOAD": "",
+        "WHISPER_MODEL_LOADER": "bench_offline:load_fake_model",
+        "BENCH_WHISPER_RTF": str(args.whisper_rtf),
+        "GC_ENABLED": "0",
+        # عمليات التفريغ المتوازية تستورد whisper الحقيقي؛ نفرّغ بالنموذج الوهمي في العملية نفسها
+        "TRANSCRIBE_CHUNKED": "0",
+        "STUB_LATENCY": str(args.ytdlp_latency),
+        "STUB_PAYLOAD_BYTES": str(int(args.payload_mb * 1024 * 1024)),
+        "STUB_AUDIO_SECONDS": str(args.audio_seconds),
+        "STUB_FORMATS": str(args.formats),
+        "STUB_HTTP_BASE": static_base,
+    })
+    import app
+    # المترجم الوهمي نفسه الذي يستخدمه bench_translate (يستورد app، لذلك بعد ضبط البيئة)
+    from bench_translate import FakeTranslator
+
+    app.translator = FakeTranslator(args.translate_latency)
+    base, _ = start_http(app.app)
+
+    results = {}
+    for name in names:
+        results[name] = run_scenario(name, base, download_folder, args.requests, args.concurrency)
+        r = results[name]
+        print(f"{name:<22} p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  p99 {r['p99_ms']} ms  "
+              f"{r['throughput_rps']} req/s  errors={r['errors']}", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+    shutil.rmtree(download_folder, ignore_errors=True)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
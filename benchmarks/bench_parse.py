@@ -0,0 +1,134 @@
+"""
+قياس زمن تحليل مخرجات yt-dlp --dump-json وذروة الذاكرة أثناءه: المسار القديم (نص + json.loads
++ build_video_info على البيانات الكاملة) مقابل المسار الحالي (bytes + json_loads + project_video_data).
+يستخدم ملفًا مسجّلًا عبر --fixture (مثل: yt-dlp --dump-json URL > video.json)، أو يولّد ملفًا
+اصطناعيًا بحجم فيديو يوتيوب طويل (صيغ كثيرة مع fragments، وترجمات آلية لأكثر من 100 لغة).
+
+الاستخدام:
+    python benchmarks/bench_parse.py --formats 300 --languages 150 --repeat 20
+    python benchmarks/bench_parse.py --fixture video.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WHISPER_PRELOAD", "")  # لا حاجة لنماذج Whisper في هذا القياس
+os.environ.setdefault("GC_ENABLED", "0")
+
+import app  # noqa: E402
+
+CAPTION_EXTS = ("json3", "srv1", "srv2", "srv3", "ttml", "vtt")
+
+
+def make_fixture(format_count, language_count, fragments):
+    url = "https://www.youtube.com/watch?v=fixture0001"
+    formats = []
+    for i in range(format_count):
+        video = i % 4 != 0
+        formats.append({
+            "format_id": str(100 + i),
+            "format_note": f"{144 * (i % 8 + 1)}p" if video else "medium",
+            "ext": "mp4" if i % 2 else "webm",
+            "vcodec": "avc1.640028" if video else "none",
+            "acodec": "none" if video else "opus",
+            "height": 144 * (i % 8 + 1) if video else None,
+            "width": 256 * (i % 8 + 1) if video else None,
+            "fps": 30, "tbr": 1000.0 + i, "abr": None if video else 128.0, "asr": None if video else 48000,
+            "filesize": 10_000_000 + i,
+            "url": f"https://rr1---sn-fixture.googlevideo.com/videoplayback?expire=1700000000&itag={i}&" + "x" * 900,
+            "manifest_url": "https://manifest.googlevideo.com/api/manifest/dash/" + "y" * 400,
+            "fragments": [{"url": f"sq/{n}", "duration": 5.0} for n in range(fragments)],
+            "http_headers": {
+                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36",
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "en-us,en;q=0.5",
+                "Sec-Fetch-Mode": "navigate",
+            },
+            "downloader_options": {"http_chunk_size": 10485760},
+            "protocol": "https", "container": "mp4_dash", "dynamic_range": "SDR",
+        })
+    languages = [f"l{n:03d}" for n in range(language_count)]
+    captions = {
+        lang: [{"ext": ext, "url": f"https://www.youtube.com/api/timedtext?v=fixture0001&lang={lang}&fmt={ext}&"
+                + "z" * 300, "name": f"Language {lang}"} for ext in CAPTION_EXTS]
+        for lang in languages
+    }
+    return json.dumps({
+        "id": "fixture0001", "title": "Fixture video", "uploader": "fixture", "original_url": url,
+        "extractor_key": "Youtube", "thumbnail": "https://i.ytimg.com/vi/fixture0001/maxresdefault.jpg",
+        "description": "d" * 5000,
+        "thumbnails": [{"url": f"https://i.ytimg.com/vi/fixture0001/{n}.jpg", "id": str(n)} for n in range(40)],
+        "formats": formats,
+        "subtitles": {"en": captions[languages[0]]},
+        "automatic_captions": captions,
+    }).encode("utf-8")
+
+
+# بيانات ناقصة (لا uploader ولا original_url، وترجمة بلا name) للتأكد من بقاء القيم الافتراضية كما هي
+SPARSE_FIXTURE = json.dumps({
+    "id": "sparse00001", "title": "Sparse video",
+    "formats": [{"format_id": "18", "ext": "mp4", "vcodec": "avc1", "acodec": "mp4a", "height": 360}],
+    "subtitles": {"en": [{"ext": "vtt", "url": "https://example.invalid/en.vtt"}]},
+    "automatic_captions": {"fr": [{"ext": "srv3", "url": "https://example.invalid/fr.srv3"}]},
+}).encode("utf-8")
+SPARSE_URL = "https://www.youtube.com/watch?v=sparse00001"
+
+
+def legacy_path(raw, url=None):
+    data = json.loads(raw.decode("utf-8"))
+    return app.build_video_info(data, url or data["original_url"])
+
+
+def current_path(raw, url=None):
+    data = app.project_video_data(app.json_loads(raw))
+    return app.build_video_info(data, url or data["original_url"])
+
+
+def measure(name, fn, raw, repeat):
+    fn(raw)  # تسخين
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(raw)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    fn(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {elapsed * 1000:8.1f} ms/parse   peak {peak / 1024 / 1024:7.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", help="recorded yt-dlp --dump-json output")
+    parser.add_argument("--formats", type=int, default=300)
+    parser.add_argument("--languages", type=int, default=150)
+    parser.add_argument("--fragments", type=int, default=50, help="fragments per synthetic format")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.fixture:
+        with open(args.fixture, "rb") as f:
+            raw = f.read()
+    else:
+        raw = make_fixture(args.formats, args.languages, args.fragments)
+    print(f"payload: {len(raw) / 1024 / 1024:.1f} MB, JSON backend: {'orjson' if app.orjson else 'json'}")
+
+    legacy = measure("legacy", legacy_path, raw, args.repeat)
+    current = measure("current", current_path, raw, args.repeat)
+    assert legacy == current, "projected output differs from the legacy output"
+    assert legacy_path(SPARSE_FIXTURE, SPARSE_URL) == current_path(SPARSE_FIXTURE, SPARSE_URL), \
+        "projected output differs from the legacy output for a sparse payload"
+
+    full = len(json.dumps(current))
+    compact = len(json.dumps(app.compact_video_info(current)))
+    print(f"response: full {full / 1024:.0f} KB, compact {compact / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
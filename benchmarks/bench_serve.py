@@ -0,0 +1,123 @@
+"""
+قياس إنتاجية /api/serve لملف كبير مع عملاء متزامنين، كتنزيلات كاملة أو طلبات Range عشوائية
+(مثل التنقل داخل الفيديو). يشغّل التطبيق على خادم werkzeug متعدد الخيوط أو على gunicorn
+(الذي يرسل الملفات عبر sendfile).
+
+الاستخدام:
+    python benchmarks/bench_serve.py --size-mb 200 --clients 8 --requests 4
+    python benchmarks/bench_serve.py --server gunicorn --mode range
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WHISPER_PRELOAD", "")  # لا حاجة لنماذج Whisper في هذا القياس
+
+import app  # noqa: E402
+
+DOWNLOAD_ID = "bench-serve"
+
+
+def make_file(size_mb):
+    directory = os.path.join(app.DOWNLOAD_FOLDER, DOWNLOAD_ID)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "large.mp4")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return directory
+
+
+def start_server(kind, port):
+    if kind == "gunicorn":
+        proc = subprocess.Popen(
+            ["gunicorn", "-w", "4", "-b", f"127.0.0.1:{port}", "app:app"],
+            cwd=ROOT, env={**os.environ}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        return proc.terminate
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def wait_ready(base):
+    for _ in range(300):
+        try:
+            requests.get(base + "/", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def client(url, size, args, latencies, totals):
+    session = requests.Session()
+    for _ in range(args.requests):
+        headers = {}
+        if args.mode == "range":
+            start = random.randrange(0, max(1, size - args.range_bytes))
+            headers["Range"] = f"bytes={start}-{start + args.range_bytes - 1}"
+        began = time.perf_counter()
+        received = 0
+        with session.get(url, headers=headers, stream=True) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(1024 * 1024):
+                received += len(chunk)
+        latencies.append(time.perf_counter() - began)
+        totals.append(received)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("werkzeug", "gunicorn"), default="werkzeug")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=4, help="requests per client")
+    parser.add_argument("--mode", choices=("full", "range"), default="full")
+    parser.add_argument("--range-bytes", type=int, default=4 * 1024 * 1024)
+    args = parser.parse_args()
+
+    directory = make_file(args.size_mb)
+    stop = start_server(args.server, args.port)
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base)
+        url = f"{base}/api/serve/{DOWNLOAD_ID}/large.mp4"
+        size = args.size_mb * 1024 * 1024
+        latencies, totals = [], []
+        threads = [threading.Thread(target=client, args=(url, size, args, latencies, totals))
+                   for _ in range(args.clients)]
+        began = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - began
+    finally:
+        stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    latencies.sort()
+    print(f"server={args.server} mode={args.mode} clients={args.clients} requests={len(latencies)}")
+    print(f"throughput: {sum(totals) / elapsed / 1024 / 1024:.1f} MiB/s over {elapsed:.2f} s")
+    print(f"latency: p50={statistics.median(latencies) * 1000:.1f} ms  "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+قياس سرعة ترجمة ملف VTT (كتلة/ثانية) بالطريقة التسلسلية (سطر بسطر) وبالدفعات المتوازية،
+باستخدام مترجم وهمي محلي يضيف تأخيرًا ثابتًا لكل طلب بدل Google Translate.
+
+الاستخدام:
+    python benchmarks/bench_translate.py --cues 1500 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WHISPER_PRELOAD", "")  # لا حاجة لنماذج Whisper في هذا القياس
+
+import app  # noqa: E402
+
+
+class _Translated:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeTranslator:
+    """مترجم وهمي: يحاكي زمن الرحلة للشبكة ويعيد النص بأحرف كبيرة."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def translate(self, text, dest="en", src="auto"):
+        self.calls += 1
+        time.sleep(self.latency)
+        return _Translated(text.upper())
+
+
+def make_vtt(cue_count):
+    lines = ["WEBVTT", "Kind: captions", "Language: en", ""]
+    for i in range(cue_count):
+        start, end = i * 2, i * 2 + 2
+        lines.append(f"00:{start // 60 % 60:02d}:{start % 60:02d}.000 --> 00:{end // 60 % 60:02d}:{end % 60:02d}.000")
+        lines.append(f"caption number {i} with some words")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def run(name, vtt, cue_count, fake, **kwargs):
+    fake.calls = 0
+    start = time.perf_counter()
+    output = app.parse_vtt_and_translate(vtt, "ar", **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<8} {elapsed:8.2f} s  {cue_count / elapsed:10.1f} cues/s  translator calls={fake.calls}")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cues", type=int, default=1500)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per translator call")
+    parser.add_argument("--workers", type=int, default=app.TRANSLATE_WORKERS)
+    parser.add_argument("--batch-chars", type=int, default=app.TRANSLATE_BATCH_CHARS)
+    args = parser.parse_args()
+
+    fake = FakeTranslator(args.latency)
+    app.translator = fake
+    vtt = make_vtt(args.cues)
+
+    # ذاكرة ترجمة مؤقتة حتى لا تختلط الترجمات الوهمية بالذاكرة الحقيقية
+    app.translation_memory = app.TranslationMemory(
+        os.path.join(tempfile.mkdtemp(prefix="bench_tm_"), "tm.sqlite3"), app.TRANSLATION_MEMORY_MAX_ENTRIES
+    )
+
+    serial = run("serial", vtt, args.cues, fake, batch_chars=0, workers=1, use_memory=False)
+    batched = run("batched", vtt, args.cues, fake, batch_chars=args.batch_chars, workers=args.workers,
+                  use_memory=False)
+    assert serial == batched, "batched output differs from serial output"
+
+    run("tm-cold", vtt, args.cues, fake)
+    memory = run("tm-warm", vtt, args.cues, fake)
+    assert memory == serial, "translation memory output differs from serial output"
+    print(f"translation memory: {app.translation_memory.stats()}")
+
+
+if __name__ == "__main__":
+    main()
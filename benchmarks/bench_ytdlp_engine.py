@@ -0,0 +1,83 @@
+"""
+مقارنة زمن استخراج البيانات بين تشغيل yt-dlp كعملية جديدة لكل طلب (بارد)
+وبين المحرك الداخلي InProcessEngine (دافئ)، على خادم HTTP محلي يقدّم ملف فيديو مباشر
+يتعامل معه المستخرج العام (generic) دون أي اتصال بالإنترنت.
+
+الاستخدام:
+    python benchmarks/bench_ytdlp_engine.py --runs 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WHISPER_PRELOAD", "")  # لا حاجة لنماذج Whisper في هذا القياس
+
+import app  # noqa: E402
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(size_bytes):
+    root = tempfile.mkdtemp(prefix="bench_ytdlp_")
+    with open(os.path.join(root, "clip.mp4"), "wb") as f:
+        f.write(os.urandom(size_bytes))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/clip.mp4"
+
+
+def time_runs(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<18} mean={statistics.mean(samples) * 1000:8.1f} ms  "
+          f"median={statistics.median(samples) * 1000:8.1f} ms  p95={p95 * 1000:8.1f} ms")
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--size", type=int, default=256 * 1024, help="stub video size in bytes")
+    args = parser.parse_args()
+
+    server, url = start_stub_server(args.size)
+    cold_cmd = [app.get_yt_dlp_path(), "--dump-json", "--skip-download", "--no-warnings", url]
+
+    def cold():
+        subprocess.run(cold_cmd, capture_output=True, text=True, check=True, timeout=60)
+
+    engine = app.InProcessEngine(workers=1)
+    engine.extract_info(url, timeout=60)  # تسخين: استيراد المستخرجات وتهيئتها مرة واحدة
+
+    def warm():
+        engine.extract_info(url, timeout=60)
+
+    print(f"stub url: {url}  runs: {args.runs}")
+    cold_median = summarize("cold subprocess", time_runs(cold, args.runs))
+    warm_median = summarize("warm engine", time_runs(warm, args.runs))
+    print(f"speedup (median): {cold_median / warm_median:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+تفريغ الصوت الطويل على قطع: فك الترميز عبر ffmpeg إلى PCM أحادي بتردد 16 kHz، تقسيمه
+عند فترات الصمت بكاشف طاقة بسيط (VAD)، ثم تفريغ القطع بالتوازي في مجموعة عمليات
+(أو واحدة تلو الأخرى داخل العملية) وإعادة ترتيب المقاطع بتوقيتاتها الأصلية.
+
+هذه الوحدة لا تستورد app.py حتى تكون آمنة للاستيراد داخل عمليات العمّال (spawn).
+"""
+import hashlib
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+# حد الصمت نسبي لطاقة التسجيل نفسه (SILENCE_RELATIVE من المئين 95 لطاقة الإطارات) حتى لا يُعتبر
+# تسجيل هادئ كله صمتًا، مع سقف SILENCE_RMS (حوالي -40 dBFS) وحد أدنى SILENCE_FLOOR_RMS (حوالي -80 dBFS)
+SILENCE_RMS = 0.01
+SILENCE_RELATIVE = 0.1
+SILENCE_FLOOR_RMS = 0.0001
+
+
+def pcm_from_bytes(raw):
+    """يحوّل PCM بصيغة s16le إلى مصفوفة float32 بين -1 و 1 كما يتوقعها Whisper."""
+    return np.frombuffer(raw, np.int16).astype(np.float32) / 32768.0
+
+
+def decode_audio_pcm(path):
+    """
+    يفك ترميز ملف صوتي عبر ffmpeg إلى PCM أحادي بتردد 16 kHz.
+    """
+    command = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", path,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+        "-loglevel", "error",
+        "-",
+    ]
+    result = subprocess.run(command, capture_output=True, check=True)
+    return pcm_from_bytes(result.stdout)
+
+
+class StreamCancelled(Exception):
+    """أُلغي البث عبر cancel_event (قبل اكتماله)."""
+
+
+def _read_all(stream, chunks):
+    chunks.append(stream.read())
+
+
+def stream_audio_pcm(source_command, timeout, chunk_size=64 * 1024, cancel_event=None):
+    """
+    يمرّر مخرجات source_command (مثل yt-dlp -o -) مباشرة إلى ffmpeg ويعيد PCM كمصفوفة NumPy
+    دون أي ملف وسيط. يعيد (pcm, stats) حيث stats فيها عدد البايتات المنقولة وبصمتها SHA-256
+    والزمن المستغرق. يرمي subprocess.CalledProcessError أو subprocess.TimeoutExpired عند الفشل،
+    و StreamCancelled إذا ضُبط cancel_event (بعد إيقاف العمليتين).
+    """
+    started = time.monotonic()
+    source = subprocess.Popen(source_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    decoder = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+         "-loglevel", "error", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    digest = hashlib.sha256()
+    transferred = [0]
+
+    def relay():
+        # ننسخ البايتات بأنفسنا بدل ربط الأنبوبين مباشرة حتى نعدّها ونحسب بصمتها
+        try:
+            for chunk in iter(lambda: source.stdout.read(chunk_size), b""):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                transferred[0] += len(chunk)
+                digest.update(chunk)
+                decoder.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                decoder.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    source_err, decoder_err, decoded = [], [], []
+    threads = [
+        threading.Thread(target=relay, daemon=True),
+        threading.Thread(target=_read_all, args=(source.stderr, source_err), daemon=True),
+        threading.Thread(target=_read_all, args=(decoder.stderr, decoder_err), daemon=True),
+        threading.Thread(target=_read_all, args=(decoder.stdout, decoded), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+    deadline = started + timeout
+    for proc, command in ((source, source_command), (decoder, ["ffmpeg"])):
+        # ننتظر على فترات قصيرة حتى نلاحظ الإلغاء أثناء البث
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                # لا ننتظر خيوط القراءة: عمليات فرعية للمصدر قد تبقي الأنبوب مفتوحًا (الخيوط daemon)
+                source.kill()
+                decoder.kill()
+                raise StreamCancelled()
+            try:
+                proc.wait(timeout=max(0.01, min(0.2, deadline - time.monotonic())))
+                break
+            except subprocess.TimeoutExpired:
+                if time.monotonic() >= deadline:
+                    source.kill()
+                    decoder.kill()
+                    raise subprocess.TimeoutExpired(command, timeout)
+    for t in threads:
+        t.join()
+
+    if source.returncode != 0:
+        raise subprocess.CalledProcessError(
+            source.returncode, source_command, stderr=b"".join(source_err).decode("utf-8", "replace")
+        )
+    if decoder.returncode != 0:
+        raise subprocess.CalledProcessError(
+            decoder.returncode, ["ffmpeg"], stderr=b"".join(decoder_err).decode("utf-8", "replace")
+        )
+
+    pcm = pcm_from_bytes(b"".join(decoded))
+    return pcm, {
+        "bytes_transferred": transferred[0],
+        "audio_sha256": digest.hexdigest(),
+        "seconds": round(time.monotonic() - started, 3),
+        "audio_seconds": round(len(pcm) / SAMPLE_RATE, 3),
+    }
+
+
+def split_on_silence(pcm, target_seconds=30, max_seconds=60, min_silence_seconds=0.3):
+    """
+    يقسّم الصوت إلى قطع طولها بين target_seconds/2 و max_seconds، ويقطع عند فترة صمت
+    (طاقة منخفضة بعد التنعيم على min_silence_seconds) هي الأقرب إلى target_seconds،
+    أو عند أهدأ نقطة إن لم يوجد صمت، حتى لا تنقسم كلمة بين قطعتين.
+    يعيد قائمة (بداية، نهاية، فيها_كلام) بوحدة العيّنات.
+    """
+    frame = int(SAMPLE_RATE * FRAME_SECONDS)
+    n_frames = len(pcm) // frame
+    if n_frames == 0:
+        return [(0, len(pcm), False)]
+
+    energy = np.sqrt(np.mean(np.square(pcm[:n_frames * frame].reshape(n_frames, frame)), axis=1))
+    threshold = max(SILENCE_FLOOR_RMS, min(SILENCE_RMS, SILENCE_RELATIVE * float(np.percentile(energy, 95))))
+    window = max(1, int(min_silence_seconds / FRAME_SECONDS))
+    smoothed = np.convolve(energy, np.ones(window) / window, mode="same")
+
+    min_frames = max(1, int(target_seconds / 2 / FRAME_SECONDS))
+    target_frames = max(min_frames, int(target_seconds / FRAME_SECONDS))
+    max_frames = max(min_frames + 1, int(max_seconds / FRAME_SECONDS))
+
+    bounds = []
+    start = 0
+    while n_frames - start > max_frames:
+        lo, hi = start + min_frames, start + max_frames
+        silent = np.flatnonzero(smoothed[lo:hi] < threshold)
+        if len(silent):
+            cut = lo + int(silent[np.argmin(np.abs(silent + lo - start - target_frames))])
+        else:
+            cut = lo + int(np.argmin(smoothed[lo:hi]))
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, n_frames))
+
+    chunks = []
+    for i, (a, b) in enumerate(bounds):
+        end = len(pcm) if i == len(bounds) - 1 else b * frame
+        voiced = bool(np.max(energy[a:b]) >= threshold) if b > a else False
+        chunks.append((a * frame, end, voiced))
+    return chunks
+
+
+# --- داخل عمليات العمّال --- #
+
+_worker_models = {}
+
+
+def _offset_segments(result, offset):
+    segments = [
+        {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"]}
+        for seg in result["segments"]
+    ]
+    return result.get("language"), segments
+
+
+def _transcribe_chunk(model_size, pcm, offset, options, threads):
+    import torch
+    import whisper
+    # عدد القطع المتزامنة يختلف حسب حجم النموذج، فتُوزَّع الأنوية عليها في كل استدعاء
+    torch.set_num_threads(threads)
+    model = _worker_models.get(model_size)
+    if model is None:
+        # نموذج واحد لكل عملية: حساب الذاكرة في الأب يفترض ذلك
+        _worker_models.clear()
+        model = _worker_models[model_size] = whisper.load_model(model_size)
+    return _offset_segments(model.transcribe(pcm, **options), offset)
+
+
+class _ChunkResults:
+    """نتائج القطع بترتيبها، مع المقاطع المتصلة من بداية الصوت لتمريرها إلى on_partial."""
+
+    def __init__(self, chunks, on_partial):
+        self.results = [None if voiced else (None, []) for _, _, voiced in chunks]
+        self.done = len(chunks) - sum(voiced for _, _, voiced in chunks)
+        self.prefix = 0
+        self.on_partial = on_partial
+
+    def add(self, i, result):
+        self.results[i] = result
+        self.done += 1
+        while self.prefix < len(self.results) and self.results[self.prefix] is not None:
+            self.prefix += 1
+        if self.on_partial:
+            segments = [seg for _, segs in self.results[:self.prefix] for seg in segs]
+            self.on_partial(segments, self.done, len(self.results))
+
+    def merged(self):
+        languages = Counter(lang for lang, segs in self.results if lang and segs)
+        return {
+            "language": languages.most_common(1)[0][0] if languages else None,
+            "segments": [seg for _, segs in self.results for seg in segs],
+        }
+
+
+class ChunkedTranscriber:
+    """
+    يفرّغ القطع بالتوازي في ProcessPoolExecutor، فيتناسب زمن التفريغ مع عدد الأنوية.
+    كل عملية تحمّل نسختها من النموذج عند أول قطعة، لذلك الذاكرة = عدد القطع المتزامنة × حجم النموذج.
+    """
+
+    def __init__(self, processes, target_seconds=30, max_seconds=60):
+        self.processes = processes or os.cpu_count() or 1
+        self.target_seconds = target_seconds
+        self.max_seconds = max_seconds
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def transcribe(self, pcm, model_size, on_partial=None, parallel=None, **options):
+        """
+        يعيد {"language", "segments"} مرتبة زمنيًا. on_partial(segments, done, total) يُستدعى
+        كلما اكتملت قطعة، مع المقاطع المتصلة من بداية الصوت حتى الآن؛ وإذا رمى استثناءً
+        تُلغى القطع المتبقية. parallel يحدّ عدد القطع قيد التفريغ في الوقت نفسه (افتراضيًا processes).
+        """
+        chunks = split_on_silence(pcm, self.target_seconds, self.max_seconds)
+        collected = _ChunkResults(chunks, on_partial)
+        pending = [i for i, (_, _, voiced) in enumerate(chunks) if voiced]
+        limit = max(1, min(parallel or self.processes, self.processes))
+        threads = max(1, (os.cpu_count() or 1) // limit)
+        pool = self._get_pool()
+        futures = {}
+        try:
+            while pending or futures:
+                while pending and len(futures) < limit:
+                    i = pending.pop(0)
+                    start, end, _ = chunks[i]
+                    args = (model_size, pcm[start:end], start / SAMPLE_RATE, options, threads)
+                    futures[pool.submit(_transcribe_chunk, *args)] = i
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collected.add(futures.pop(future), future.result())
+        finally:
+            for future in futures:
+                future.cancel()
+        return collected.merged()
+
+    def transcribe_in_process(self, pcm, transcribe, on_partial=None, **options):
+        """
+        مثل transcribe لكن القطع تُفرَّغ واحدة تلو الأخرى في هذه العملية عبر transcribe(pcm, **options)
+        (مثل WhisperModelManager)، فتصل النتائج الجزئية دون عمليات إضافية.
+        """
+        chunks = split_on_silence(pcm, self.target_seconds, self.max_seconds)
+        collected = _ChunkResults(chunks, on_partial)
+        for i, (start, end, voiced) in enumerate(chunks):
+            if voiced:
+                collected.add(i, _offset_segments(transcribe(pcm[start:end], **options), start / SAMPLE_RATE))
+        return collected.merged()